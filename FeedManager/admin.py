@@ -9,6 +9,7 @@ from django.core.management import call_command
 from huey.contrib.djhuey import task
 from nested_admin.nested import NestedModelAdmin, NestedTabularInline
 from .tasks import async_update_feeds_and_digest, clean_old_articles
+from . import circuit_breaker
 
 def update_selected_feeds(modeladmin, request, queryset):
     for feed in queryset:
@@ -21,7 +22,14 @@ def clean_selected_feeds_articles(modeladmin, request, queryset):
         clean_old_articles(feed.id)
         modeladmin.message_user(request, f"Cleaned old articles from feed: {feed.title}")
 
+def reset_circuit_breaker(modeladmin, request, queryset):
+    for feed in queryset:
+        circuit_breaker.reset(feed)
+        feed.save()
+        modeladmin.message_user(request, f"Reset circuit breaker for feed: {feed.title}")
+
 clean_selected_feeds_articles.short_description = "Clean old articles for selected feeds"
+reset_circuit_breaker.short_description = "Reset circuit breaker for selected feeds"
 update_selected_feeds.short_description = "Update selected feeds"
 
 class FilterInline(NestedTabularInline):
@@ -38,7 +46,7 @@ class ArticleInline(admin.TabularInline):
     model = Article
     form = ReadOnlyArticleForm
     extra = 0
-    readonly_fields = [field.name for field in Article._meta.fields if field.name != 'content']
+    readonly_fields = [field.name for field in Article._meta.fields if field.name not in ('content', 'raw_content')]
 
     def has_add_permission(self, request, obj=None):
         return False
@@ -147,7 +155,7 @@ class IncludedInProcessedFeedListFilter(admin.SimpleListFilter):
 
 class OriginalFeedAdmin(admin.ModelAdmin):
     inlines = [ArticleInline]
-    list_display = ('title', 'valid', 'url', 'processed_feeds_count')
+    list_display = ('title', 'valid', 'url', 'processed_feeds_count', 'next_poll', 'circuit_state')
     search_fields = ('title', 'url') 
 
     def get_queryset(self, request):
@@ -162,9 +170,16 @@ class OriginalFeedAdmin(admin.ModelAdmin):
     processed_feeds_count.admin_order_field = '_processed_feeds_count'  # Allows column to be sortable
     processed_feeds_count.short_description = 'Processed Feeds'
 
+    def circuit_state(self, obj):
+        state = circuit_breaker.circuit_state(obj)
+        if state == circuit_breaker.CLOSED:
+            return state
+        return f"{state} ({obj.failure_count} failures, retry at {obj.retry_at:%Y-%m-%d %H:%M})"
+    circuit_state.short_description = 'Circuit'
+
     # Filter if the original feed is included in the processed feed
     list_filter = ('valid', 'processed_feeds__name', IncludedInProcessedFeedListFilter, 'tags')
-    actions = [clean_selected_feeds_articles]
+    actions = [clean_selected_feeds_articles, reset_circuit_breaker]
     autocomplete_fields = ['tags']
 
 admin.site.register(ProcessedFeed, ProcessedFeedAdmin)
@@ -0,0 +1,57 @@
+import logging
+import os
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+
+logger = logging.getLogger('feed_logger')
+
+BREAKER_BASE_DELAY = timedelta(minutes=int(os.environ.get('BREAKER_BASE_DELAY', 5)))
+BREAKER_MAX_DELAY = timedelta(minutes=int(os.environ.get('BREAKER_MAX_DELAY', 1440)))
+# 指数到这里延迟已经不小于 max，之后不再增长；长期失败的源 failure_count 很大，直接算 2 ** n 会溢出
+MAX_BACKOFF_EXPONENT = (BREAKER_MAX_DELAY // BREAKER_BASE_DELAY).bit_length() if BREAKER_BASE_DELAY else 0
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def circuit_state(original_feed, now=None):
+    '''
+    closed: 源正常；open: 连续失败，在 retry_at 之前跳过；
+    half_open: 已经到了 retry_at，下一次拉取是试探，成功就恢复，失败就继续退避。
+    '''
+    if not original_feed.failure_count:
+        return CLOSED
+    if original_feed.retry_at and original_feed.retry_at > (now or timezone.now()):
+        return OPEN
+    return HALF_OPEN
+
+
+def is_open(original_feed, now=None):
+    return circuit_state(original_feed, now) == OPEN
+
+
+def backoff_delay(failure_count):
+    '指数退避加随机抖动：第 n 次失败等待 base * 2^(n-1)，不超过 max，再在后一半区间内随机，避免失败的源同时重试'
+    delay = min(BREAKER_BASE_DELAY * 2 ** min(failure_count - 1, MAX_BACKOFF_EXPONENT), BREAKER_MAX_DELAY)
+    return delay / 2 + delay / 2 * random.random()
+
+
+def record_failure(original_feed, now=None):
+    'original_feed 拉取失败，结果写在 original_feed 上，由调用方保存'
+    original_feed.failure_count += 1
+    original_feed.retry_at = (now or timezone.now()) + backoff_delay(original_feed.failure_count)
+    logger.warning(f'                [-] Feed {original_feed.url} failed {original_feed.failure_count} times in a row, retry at {original_feed.retry_at}')
+
+
+def record_success(original_feed):
+    original_feed.failure_count = 0
+    original_feed.retry_at = None
+
+
+def reset(original_feed):
+    '手动重置：清空失败计数，下一轮立即拉取'
+    record_success(original_feed)
+    original_feed.next_poll = None
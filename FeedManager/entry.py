@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytz
+
+from FeedManager.utils import clean_url
+
+
+class Entry:
+    '''
+    规范化后的 entry，拉取解析后或从数据库读出后立即构建，filter、路由、已知 entry 索引和入库都只用它，
+    不再用 try/except 探测 FeedParserDict 的字段，体积很大的 FeedParserDict 也可以尽早释放。
+    title: 标题，没有标题时是链接
+    link: 原始链接；url: clean_url 之后的链接，没有链接时都是 ''
+    text: filter 的 content 字段匹配的文本
+    content: feed 自带的原文，has_content 表示原文来自 <content> 而不是 <description>
+    published: 发布时间（UTC datetime），没有时为 None
+    source_id: original feed 的 id
+    '''
+    __slots__ = ('title', 'link', 'url', 'text', 'content', 'has_content', 'published', 'source_id')
+
+    def __init__(self, title, link, text, content='', has_content=False, published=None, source_id=None):
+        self.title = title
+        self.link = link
+        self.url = clean_url(link) if link else ''
+        self.text = text
+        self.content = content
+        self.has_content = has_content
+        self.published = published
+        self.source_id = source_id
+
+    @classmethod
+    def from_feedparser(cls, entry, source_id=None):
+        content = entry.content[0].get('value') if entry.get('content') else None
+        description = entry.get('description')
+        text = ''
+        if content is not None:
+            text += content + ' '
+        if description is not None:
+            text += description + ' '
+        published = entry.get('published_parsed')
+        return cls(
+            title=entry.get('title') or entry.get('link') or '',
+            link=entry.get('link') or '',
+            text=text,
+            content=content if content is not None else (description or ''),
+            has_content='content' in entry,
+            published=datetime(*published[:6], tzinfo=pytz.UTC) if published else None,
+            source_id=source_id,
+        )
+
+    @classmethod
+    def from_article(cls, article):
+        return cls(
+            title=article.title,
+            link=article.link,
+            text=article.content + ' ' if article.content else '',
+            content=article.content or '',
+            has_content=bool(article.content),
+            published=article.published_date,
+            source_id=article.original_feed_id,
+        )
+
+    def __repr__(self):
+        return f'<Entry {self.title!r} {self.link}>'
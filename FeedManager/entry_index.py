@@ -0,0 +1,67 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from FeedManager.models import Article
+
+logger = logging.getLogger('feed_logger')
+
+KNOWN_ENTRY_TTL = int(os.environ.get('KNOWN_ENTRY_TTL', 7 * 24 * 3600))  # 秒
+# 比高水位早这么久的 entry 才直接丢弃，留出余量给补发、发布时间不准的源
+KNOWN_ENTRY_GRACE = timedelta(hours=int(os.environ.get('KNOWN_ENTRY_GRACE', 72)))
+
+
+class KnownEntryIndex:
+    '''
+    单个 original feed 已经处理过的 entry（entry.Entry）：上次拉取时见过的 clean_url 集合，加上发布时间的高水位。
+    存在 Django cache 中（settings.CACHES，Redis），web 进程和 huey worker 共用；缓存失效时从数据库里的文章重建链接集合。
+    见过的 entry 在 filter 和数据库查询之前就被丢弃。
+    '''
+
+    def __init__(self, original_feed_id):
+        self.original_feed_id = original_feed_id
+        data = cache.get(self.cache_key(original_feed_id))
+        if data is None:
+            data = self._load()
+        self.links = data['links']
+        self.high_water_mark = data['high_water_mark']
+
+    @staticmethod
+    def cache_key(original_feed_id):
+        return f'known_entries:{original_feed_id}'
+
+    @classmethod
+    def invalidate(cls, original_feed_ids):
+        cache.delete_many([cls.cache_key(original_feed_id) for original_feed_id in original_feed_ids])
+
+    def _load(self):
+        # 缓存失效（过期、新订阅、filter 修改）后的第一轮没有高水位：数据库里只有通过了 filter 的文章，
+        # 用它们的发布时间做高水位会把其他 processed feed 或新 filter 还没检查过的 entry 当成已知
+        articles = Article.objects.filter(original_feed_id=self.original_feed_id)
+        return {
+            'links': set(articles.values_list('link', flat=True)),
+            'high_water_mark': None,
+        }
+
+    def is_known(self, entry):
+        if entry.url and entry.url in self.links:
+            return True
+        published = entry.published
+        return bool(published and self.high_water_mark and published < self.high_water_mark - KNOWN_ENTRY_GRACE)
+
+    def update(self, entries, unsettled=()):
+        '''
+        记录本轮拉取到的 entry，集合只保留源当前输出的这一批，内存不会无限增长。
+        unsettled 是本轮没有处理成功、下轮需要重试的 clean_url。
+        '''
+        self.links = {entry.url for entry in entries if entry.url} - set(unsettled)
+        now = timezone.now()
+        for entry in entries:
+            published = entry.published
+            # 发布时间在未来的 entry（pubDate 写错很常见）不参与高水位，否则之后所有正常的 entry 都会被当成已知而丢弃
+            if published and published <= now and (not self.high_water_mark or published > self.high_water_mark):
+                self.high_water_mark = published
+        cache.set(self.cache_key(self.original_feed_id), {'links': self.links, 'high_water_mark': self.high_water_mark}, KNOWN_ENTRY_TTL)
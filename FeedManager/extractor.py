@@ -0,0 +1,122 @@
+import logging
+import os
+import re
+
+from bs4 import BeautifulSoup, Comment
+
+logger = logging.getLogger('feed_logger')
+
+EXTRACT_MAIN_CONTENT = os.environ.get('EXTRACT_MAIN_CONTENT', '1') == '1'  # 访问原文得到的网页只保存正文
+KEEP_RAW_PAGE = os.environ.get('KEEP_RAW_PAGE') == '1'  # 同时把整个网页保存到 Article.raw_content
+
+# 整个去掉的标签：脚本、样式、表单控件和页面框架
+JUNK_TAGS = ['script', 'style', 'noscript', 'template', 'iframe', 'form', 'button', 'input', 'select', 'textarea',
+             'svg', 'canvas', 'nav', 'header', 'footer', 'aside', 'link', 'meta']
+# class / id 中出现这些词的元素多半是正文
+POSITIVE_RE = re.compile(r'article|body|content|entry|main|page|post|text|blog|story|detail', re.I)
+# class / id 中出现这些词的元素多半不是正文
+NEGATIVE_RE = re.compile(r'comment|footer|footnote|header|menu|meta|nav|related|share|social|sidebar|sponsor|'
+                         r'promo|advert|\bad-|banner|breadcrumb|subscribe|newsletter|popup|modal|cookie|widget|recommend', re.I)
+# 作为段落打分的元素
+PARAGRAPH_TAGS = ['p', 'pre', 'td', 'blockquote', 'li', 'h2', 'h3']
+TAG_WEIGHTS = {'article': 10, 'main': 10, 'div': 5, 'section': 3, 'pre': 3, 'td': 3, 'blockquote': 3,
+               'form': -3, 'ol': -3, 'ul': -3, 'dl': -3, 'li': -3, 'th': -5, 'h1': -5, 'h2': -5, 'h3': -5}
+MIN_PARAGRAPH_LENGTH = 25
+MIN_CONTENT_LENGTH = 200  # 提取出的正文比这短时认为提取失败，退回到去掉脚本和页面框架后的整页
+COMMA_RE = re.compile(r'[,，、。；;]')
+
+
+def text_length(element):
+    return len(element.get_text(' ', strip=True))
+
+
+def link_density(element):
+    length = text_length(element)
+    if not length:
+        return 0
+    return sum(text_length(a) for a in element.find_all('a')) / length
+
+
+def class_weight(element):
+    weight = 0
+    for value in (' '.join(element.get('class') or []), element.get('id') or ''):
+        if not value:
+            continue
+        if NEGATIVE_RE.search(value):
+            weight -= 25
+        if POSITIVE_RE.search(value):
+            weight += 25
+    return weight
+
+
+def remove_junk(root):
+    for element in root.find_all(JUNK_TAGS):
+        element.decompose()
+    for comment in root.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    # 明显不是正文的块：侧栏、分享按钮、推荐阅读等
+    for element in root.find_all(['div', 'section', 'ul', 'ol', 'span', 'p', 'table']):
+        if element.decomposed:
+            continue
+        if class_weight(element) < 0:
+            element.decompose()
+
+
+def remove_link_lists(element):
+    '正文中主要由链接组成的短块：标签云、相关链接、分享按钮'
+    for child in element.find_all(['div', 'ul', 'ol', 'p', 'table']):
+        if not child.decomposed and text_length(child) < 200 and link_density(child) > 0.5:
+            child.decompose()
+
+
+def score_candidates(root):
+    '''
+    readability 的打分方式：每个足够长的段落按长度和标点数得分，分数加给父元素，一半加给祖父元素，
+    父元素的初始分由标签和 class/id 决定，最后按链接密度打折
+    Returns:
+        {id(element): (element, score)}，bs4 的 Tag 按内容比较相等，不能直接做字典的键
+    '''
+    scores = {}
+    for paragraph in root.find_all(PARAGRAPH_TAGS):
+        text = paragraph.get_text(' ', strip=True)
+        if len(text) < MIN_PARAGRAPH_LENGTH:
+            continue
+        score = 1 + len(COMMA_RE.findall(text)) + min(len(text) // 100, 3)
+        for level, ancestor in enumerate([paragraph.parent, paragraph.parent.parent if paragraph.parent else None]):
+            if ancestor is None or ancestor.name in (None, '[document]'):
+                break
+            if id(ancestor) not in scores:
+                scores[id(ancestor)] = (ancestor, TAG_WEIGHTS.get(ancestor.name, 0) + class_weight(ancestor))
+            element, total = scores[id(ancestor)]
+            scores[id(ancestor)] = (element, total + score / (level + 1))
+    return {key: (element, score * (1 - link_density(element))) for key, (element, score) in scores.items()}
+
+
+def extract_main_content(html):
+    '''
+    readability 风格的正文提取：去掉脚本、样式、导航、页眉页脚、评论和侧栏，找出得分最高的正文容器，
+    再带上同级的得分较高或较长的段落。
+    Returns:
+        正文的 HTML；页面太短或找不到足够长的正文时，返回去掉脚本和页面框架之后的 body
+    '''
+    soup = BeautifulSoup(html, 'html.parser')
+    remove_junk(soup)
+    body = soup.body or soup
+    scores = score_candidates(body)
+    if scores:
+        top, top_score = max(scores.values(), key=lambda item: item[1])
+        threshold = max(10, top_score * 0.2)
+        parts = []
+        siblings = top.parent.find_all(recursive=False) if top.parent is not None else [top]
+        for sibling in siblings:
+            if sibling is top or scores.get(id(sibling), (None, 0))[1] >= threshold:
+                parts.append(sibling)
+            elif sibling.name == 'p' and text_length(sibling) > 80 and link_density(sibling) < 0.25:
+                parts.append(sibling)
+        for part in parts:
+            remove_link_lists(part)
+        content = '\n'.join(str(part) for part in parts)
+        if sum(text_length(part) for part in parts) >= MIN_CONTENT_LENGTH:
+            return content
+    logger.debug('  No main content found, keeping the whole page body')
+    return body.decode_contents() if body is not soup else str(soup)
@@ -7,7 +7,9 @@ from django.utils import timezone
 import re
 from django.urls import reverse
 from .models import AppSetting
-from .utils import passes_filters, match_content, generate_untitled, remove_control_characters
+from .utils import passes_filters
+from .sanitizer import remove_control_characters
+from .entry import Entry
 
 class ProcessedAtomFeed(Feed):
     feed_type = Rss201rev2Feed
@@ -65,7 +67,7 @@ class ProcessedAtomFeed(Feed):
                 original_feed__in=obj.feeds.all()
             ).order_by('-published_date')
 
-            filtered_articles = [article for article in articles if passes_filters(article, obj, 'feed_filter')]
+            filtered_articles = [article for article in articles if passes_filters(Entry.from_article(article), obj, 'feed_filter')]
 
             seen = set()
             unique_articles = []
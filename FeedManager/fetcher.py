@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+import feedparser
+import httpx
+import pytz
+from django.utils.http import parse_http_date_safe
+
+from FeedManager.http_client import new_async_client, random_user_agent
+from FeedManager.rate_limit import polite_stream
+
+logger = logging.getLogger('feed_logger')
+
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', 20))  # 同时拉取的 original feed 数量上限
+FETCH_TIMEOUT = int(os.environ.get('FETCH_TIMEOUT', 30))
+FEED_MAX_BYTES = int(os.environ.get('FEED_MAX_BYTES', 10 * 1024 * 1024))  # 单个源最多读取的字节数
+FEED_EARLY_STOP = os.environ.get('FEED_EARLY_STOP', '0') == '1'  # 读到 max_articles_to_keep 条 entry 后停止下载和解析，只适合按时间倒序输出的源
+ENTRY_END_TAGS = (b'</item>', b'</entry>')
+ARTICLE_FETCH_CONCURRENCY = int(os.environ.get('ARTICLE_FETCH_CONCURRENCY', 10))  # 同时拉取的原文数量上限
+ARTICLE_FETCH_TIMEOUT = int(os.environ.get('ARTICLE_FETCH_TIMEOUT', 30))  # 单个原文的超时
+ARTICLE_FETCH_BUDGET = int(os.environ.get('ARTICLE_FETCH_BUDGET', 120))  # 一批原文的总时间预算，超时未完成的放弃
+
+
+async def read_feed_body(response: httpx.Response, url: str, max_entries=None):
+    '''
+    流式读取响应内容，最多读取 FEED_MAX_BYTES 字节；
+    给了 max_entries 时，读到第 max_entries 个 </item> / </entry> 就停止，并截断在这个结束标签之后。
+    只有按时间倒序输出的源前 max_entries 条才是最新的，按时间正序输出的源会只读到最旧的 entry，所以默认关闭（FEED_EARLY_STOP）。
+    '''
+    body = bytearray()
+    n_entries = 0
+    scanned = 0  # 已经统计过结束标签的位置
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > FEED_MAX_BYTES:
+            logger.warning(f'                [*] Feed {url} is larger than {FEED_MAX_BYTES} bytes, truncated')
+            del body[FEED_MAX_BYTES:]
+            break
+        if max_entries:
+            for tag in ENTRY_END_TAGS:
+                position = body.find(tag, max(scanned - len(tag) + 1, 0))
+                while position != -1:
+                    n_entries += 1
+                    if n_entries >= max_entries:
+                        logger.debug(f'                [*] Collected {n_entries} entries from {url}, stop reading')
+                        del body[position + len(tag):]
+                        return bytes(body)
+                    position = body.find(tag, position + len(tag))
+            scanned = len(body)
+    return bytes(body)
+
+
+def parse_http_date(value):
+    'HTTP 日期头 -> aware datetime，无法解析时返回 None'
+    timestamp = parse_http_date_safe(value) if value else None
+    return datetime.fromtimestamp(timestamp, tz=pytz.UTC) if timestamp is not None else None
+
+
+async def fetch_feed(client: httpx.AsyncClient, url: str, etag: str = '', last_modified: str = '', content_hash: str = '', max_entries=None, semaphore=None):
+    '''
+    拉取单个 original feed 的更新。
+    etag / last_modified 是上次响应中 ETag / Last-Modified 的原始值，原样带回做条件请求，
+    源内容没变时返回 304，不需要下载和解析。
+    content_hash 是上次响应内容的摘要，很多源每次都返回 200 和相同的内容，摘要相同时同样视为 not_modified。
+    max_entries 见 read_feed_body，semaphore 见 rate_limit.polite_stream。
+    '''
+    logger.debug(f'                [*] fetch feed for {url}')
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    headers['User-Agent'] = random_user_agent()
+    try:
+        async with polite_stream(client, url, headers, semaphore) as response:
+            if response.status_code == 200:
+                logger.debug(f"                [*] Response status: {response.status_code}, Headers: {response.headers}")
+                body = await read_feed_body(response, url, max_entries)
+                new_hash = hashlib.sha256(body).hexdigest()
+                if content_hash and new_hash == content_hash:
+                    logger.debug(f"                [*] 内容摘要没有变化")
+                    return {'feed': None, 'status': 'not_modified', 'last_modified': response.headers.get('Last-Modified', ''), 'etag': response.headers.get('ETag', ''), 'content_hash': new_hash, 'hash_hit': True}
+                # 直接把字节交给 feedparser，由它根据 XML 声明和 Content-Type 判断编码
+                feed = feedparser.parse(body, response_headers={'content-type': response.headers.get('Content-Type', '')})
+                return {'feed': feed, 'status': 'updated', 'last_modified': response.headers.get('Last-Modified', ''), 'etag': response.headers.get('ETag', ''), 'content_hash': new_hash, 'hash_hit': False}
+            elif response.status_code == 304:
+                # 304 可能带回新的校验值，没有的话沿用旧值
+                return {'feed': None, 'status': 'not_modified', 'last_modified': response.headers.get('Last-Modified', last_modified), 'etag': response.headers.get('ETag', etag), 'content_hash': content_hash}
+            else:
+                logger.error(f'                [*] Failed to fetch feed {url}: {response.status_code}')
+                return {'feed': None, 'status': 'failed'}
+
+    except Exception as e:
+        logger.error(f'                [*] Failed to fetch feed {url}: {str(e)}')
+        return {'feed': None, 'status': 'failed'}
+
+
+async def _fetch_feeds(original_feeds, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with new_async_client(timeout=FETCH_TIMEOUT) as client:
+        async def fetch_one(original_feed):
+            max_entries = original_feed.max_articles_to_keep if FEED_EARLY_STOP else None
+            return original_feed.id, await fetch_feed(client, original_feed.url, original_feed.etag, original_feed.last_modified_header, original_feed.content_hash, max_entries, semaphore)
+
+        results = await asyncio.gather(*(fetch_one(original_feed) for original_feed in original_feeds))
+    return dict(results)
+
+
+def fetch_feeds(original_feeds, concurrency=None):
+    '''
+    并发拉取多个 original feed，慢的源不会阻塞其他源。
+    Returns:
+        {original_feed.id: {'feed', 'status', 'last_modified', 'etag', 'content_hash'}}
+    '''
+    original_feeds = list(original_feeds)  # 在进入事件循环前完成数据库查询
+    if not original_feeds:
+        return {}
+    return asyncio.run(_fetch_feeds(original_feeds, concurrency or FETCH_CONCURRENCY))
+
+
+async def fetch_page(client: httpx.AsyncClient, url: str, semaphore=None):
+    '''
+    拉取文章原文页面。非 2xx 的响应（包括 polite_stream 重试后仍是 429/503）抛出 httpx.HTTPStatusError，
+    错误页不会被当成原文保存，entry 留到下一轮重试
+    '''
+    logger.debug(f'                    [-] fetch full content for : {url}')
+    async with polite_stream(client, url, {'User-Agent': random_user_agent()}, semaphore) as response:
+        if not response.is_success:
+            raise httpx.HTTPStatusError(f'HTTP {response.status_code}', request=response.request, response=response)
+        await response.aread()
+        return response.text
+
+
+async def _fetch_pages(urls, concurrency, budget):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with new_async_client(timeout=ARTICLE_FETCH_TIMEOUT) as client:
+        async def fetch_one(url):
+            try:
+                return url, await fetch_page(client, url, semaphore)
+            except Exception as e:
+                logger.error(f'                    [-] Failed to fetch full content for {url}: {str(e)}')
+                return url, None
+
+        tasks = [asyncio.create_task(fetch_one(url)) for url in urls]
+        done, pending = await asyncio.wait(tasks, timeout=budget)
+        if pending:
+            logger.warning(f'                    [-] {len(pending)} full content fetches did not finish in {budget}s, giving up')
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    return dict(task.result() for task in done)
+
+
+def fetch_pages(urls, concurrency=None, budget=None):
+    '''
+    用有上限的并发拉取一批原文页面，整批受 budget 秒的总时间预算限制。
+    Returns:
+        {url: 页面内容}，失败或超出预算的为 None 或不在结果中
+    '''
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    return asyncio.run(_fetch_pages(urls, concurrency or ARTICLE_FETCH_CONCURRENCY, budget or ARTICLE_FETCH_BUDGET))
@@ -0,0 +1,131 @@
+import logging
+import os
+from html.parser import HTMLParser
+
+logger = logging.getLogger('feed_logger')
+
+HTML_TEXT_LXML = os.environ.get('HTML_TEXT_LXML') == '1'  # 需要安装 lxml，结果和 html.parser 可能略有差异，见 html_to_text_lxml
+
+try:
+    import lxml.html  # 可选依赖
+except ImportError:
+    lxml = None
+
+# 整个子树连同其中的文字一起丢弃的标签
+SKIPPED_TAGS = frozenset(['script', 'style', 'img', 'a', 'video', 'audio', 'iframe', 'input'])
+# 其中的文字不算正文的标签，BeautifulSoup 的 get_text 也不输出
+HIDDEN_TEXT_TAGS = frozenset(['template', 'rt', 'rp'])
+PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+ASCII_SPACES = ' \n\t\x0c\r'
+# 没有结束标签的元素，和 BeautifulSoup 的 html.parser tree builder 一致
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+    'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer',
+])
+
+
+class TextExtractor(HTMLParser):
+    '''
+    流式提取 HTML 中的文字，跳过 SKIPPED_TAGS 的子树，不建 DOM 树，结果和 BeautifulSoup(html, 'html.parser').get_text() 一致：
+    结束标签关闭最近一个同名的未关闭标签以及它里面所有未关闭的标签，找不到同名标签时忽略；
+    两个标签之间只有空白时合并成一个换行或空格（pre、textarea 中除外）；
+    注释、doctype、处理指令以及 template、rt、rp 中的文字不输出，CDATA 段输出。
+    '''
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.data = []  # 上一个标签之后的文字
+        self.stack = []  # 未关闭的标签名
+        self.skipping = 0  # stack 中 SKIPPED_TAGS 和 HIDDEN_TEXT_TAGS 的个数，大于 0 时丢弃文字
+        self.preserving = 0  # stack 中 PRESERVE_WHITESPACE_TAGS 的个数
+
+    def flush(self):
+        if not self.data:
+            return
+        data = ''.join(self.data)
+        self.data = []
+        if self.skipping:
+            return
+        if not self.preserving and not data.strip(ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+        self.parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in VOID_TAGS:
+            return
+        self.stack.append(tag)
+        self.skipping += tag in SKIPPED_TAGS or tag in HIDDEN_TEXT_TAGS
+        self.preserving += tag in PRESERVE_WHITESPACE_TAGS
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag not in self.stack:
+            return
+        while True:
+            name = self.stack.pop()
+            self.skipping -= name in SKIPPED_TAGS or name in HIDDEN_TEXT_TAGS
+            self.preserving -= name in PRESERVE_WHITESPACE_TAGS
+            if name == tag:
+                return
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    def unknown_decl(self, data):
+        self.flush()
+        if data.startswith('CDATA['):
+            self.data.append(data[len('CDATA['):])
+            self.flush()
+
+    def close(self):
+        super().close()
+        self.flush()
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def html_to_text_python(html):
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def html_to_text_lxml(html):
+    '''
+    lxml（libxml2）解析更快，但对不规范 HTML 的容错方式和 html.parser 不同，空白和个别残缺标签的结果可能略有差异
+    '''
+    root = lxml.html.document_fromstring(html)
+    for element in list(root.iter(*SKIPPED_TAGS, *HIDDEN_TEXT_TAGS)):
+        # drop_tree 保留元素后面的 tail 文字
+        element.drop_tree()
+    return root.text_content()
+
+
+def html_to_text(html):
+    '''
+    HTML 转成纯文本，去掉 script、style、图片、链接、音视频、iframe、input 及其中的文字
+    Returns:
+        纯文本，空白原样保留
+    '''
+    if not html:
+        return ''
+    if lxml is not None and HTML_TEXT_LXML:
+        try:
+            return html_to_text_lxml(html)
+        except Exception as e:
+            # 空文档、带编码声明的 XML 等 lxml 不接受的输入
+            logger.debug(f'  lxml failed to parse html, falling back to html.parser: {str(e)}')
+    return html_to_text_python(html)
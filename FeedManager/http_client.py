@@ -0,0 +1,130 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from functools import lru_cache
+
+import httpcore
+import httpx
+from fake_useragent import UserAgent
+
+logger = logging.getLogger('feed_logger')
+
+HTTP_TIMEOUT = int(os.environ.get('HTTP_TIMEOUT', 30))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))  # 每个连接池保持的空闲长连接
+HTTP2 = os.environ.get('HTTP2') == '1'  # 需要安装 h2
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))  # 秒，0 表示关闭 DNS 缓存
+DNS_CACHE_SIZE = 1024
+
+_dns_cache = {}  # {(host, port): (过期时间, [ip])}
+_dns_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _user_agent():
+    # UserAgent() 需要加载整份浏览器数据，每个进程只加载一次
+    return UserAgent()
+
+
+def random_user_agent():
+    return _user_agent().random.strip()
+
+
+async def _resolve(host, port):
+    '''
+    解析 host，结果按 DNS_CACHE_TTL 缓存在进程内，各轮的客户端共用
+    Returns:
+        ip 列表，按 getaddrinfo 返回的顺序
+    '''
+    key = (host, port)
+    now = time.monotonic()
+    with _dns_lock:
+        cached = _dns_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise httpcore.ConnectError(f'Failed to resolve {host}: {e}') from e
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    with _dns_lock:
+        if len(_dns_cache) >= DNS_CACHE_SIZE:
+            _dns_cache.clear()
+        _dns_cache[key] = (now + DNS_CACHE_TTL, addresses)
+    return addresses
+
+
+class CachingResolverBackend(httpcore.AsyncNetworkBackend):
+    '''
+    只给 new_async_client 创建的客户端用的网络后端：连接前先查 DNS 缓存，再按 ip 建立 TCP 连接，
+    同一个 host 的请求不再重复做 DNS 解析。TLS 的 SNI 和证书校验仍然用原来的 host（httpcore 单独传 server_hostname），
+    进程里的其他连接（Redis、OpenAI 等）不受影响。
+    '''
+
+    def __init__(self, backend=None):
+        self._backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            ipaddress.ip_address(host)
+            addresses = [host]
+        except ValueError:
+            addresses = await _resolve(host, port)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        error = httpcore.ConnectError(f'No address found for {host}')
+        # 依次尝试各个地址，共用一个连接超时
+        for address in addresses:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                return await self._backend.connect_tcp(address, port, timeout=remaining,
+                                                       local_address=local_address, socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+
+@lru_cache(maxsize=1)
+def _http2_enabled():
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning('HTTP2=1 but the h2 package is not installed, falling back to HTTP/1.1')
+        return False
+    return True
+
+
+def _client_options(**overrides):
+    options = {
+        'timeout': HTTP_TIMEOUT,
+        'follow_redirects': True,
+        'http2': _http2_enabled(),
+        'limits': httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS),
+    }
+    options.update(overrides)
+    return options
+
+
+def new_async_client(**overrides):
+    '''
+    创建拉取 feed 和原文用的异步客户端，按 host 复用长连接（省去重复的 TCP/TLS 握手）。
+    AsyncClient 绑定在创建它的事件循环上，不能跨 asyncio.run 复用，所以每轮的 feed 和原文各用一个，
+    一轮之内同一个 host 的请求复用连接池。
+    '''
+    options = _client_options(**overrides)
+    if DNS_CACHE_TTL > 0 and 'transport' not in options:
+        transport = httpx.AsyncHTTPTransport(http2=options['http2'], limits=options['limits'])
+        # httpx 不接受 network_backend 参数，换掉它的 httpcore 连接池使用的后端
+        transport._pool._network_backend = CachingResolverBackend()
+        options['transport'] = transport
+    return httpx.AsyncClient(**options)
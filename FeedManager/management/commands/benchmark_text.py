@@ -0,0 +1,143 @@
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from FeedManager import html_text
+from FeedManager.extractor import extract_main_content
+from FeedManager.sanitizer import clean_content, remove_control_characters
+
+# 生成测试正文用的 HTML 片段，包含制表符、换行、ANSI 转义序列和控制字符
+ASCII_BLOCK = ('<div class="post">\n\t<h2>Patch Tuesday</h2>\r\n\t<p>Microsoft fixed 57 vulnerabilities, '
+               'including <b>CVE-2024-21412</b>.\x01 \x1b[31mcritical\x1b[0m</p>\n</div>\n')
+CJK_BLOCK = ('<div class="post">\n\t<h2>补丁星期二</h2>\r\n\t<p>微软修复了 57 个漏洞，'
+             '其中包括 <b>CVE-2024-21412</b>。\x01 \x1b[31m严重\x1b[0m</p>\n</div>\n')
+# 一篇文章的 HTML 片段，包含需要整体丢弃的 script、style、链接、图片、iframe
+ARTICLE_BLOCK = ('<style>.post{margin:0}</style><section><h3>漏洞分析 Analysis</h3>\n'
+                 '<p>攻击者利用 <a href="https://example.com/cve">CVE-2024-3400</a> 在 PAN-OS 上执行任意代码，'
+                 'the &quot;GlobalProtect&quot; gateway is exposed &amp; unauthenticated.</p>\n'
+                 '<img src="diagram.png" alt="diagram"><pre>curl -k https://target/ssl-vpn/hipreport.esp</pre>\n'
+                 '<script>window.dataLayer = window.dataLayer || []; gtag("js", new Date());</script>\n'
+                 '<ul><li>影响版本 10.2</li><li>影响版本 11.0</li></ul><iframe src="https://video"></iframe></section>\n')
+# 一个典型的新闻网页：导航、侧栏、评论、页脚和统计脚本包围着正文
+PAGE_TEMPLATE = '''<!DOCTYPE html><html><head><title>Critical PAN-OS flaw exploited</title>
+<style>body{{font-family:sans-serif}} .nav{{display:flex}} .sidebar{{width:30%}}</style>
+<script>window.dataLayer=window.dataLayer||[];function gtag(){{dataLayer.push(arguments)}}gtag('js',new Date());</script></head>
+<body><header class="site-header"><a href="/">SecNews</a><nav class="main-nav"><ul>{nav}</ul></nav></header>
+<div class="breadcrumb"><a href="/">Home</a> &raquo; <a href="/news">News</a></div>
+<div id="container"><article class="post"><h1 class="entry-title">Critical PAN-OS flaw exploited in the wild</h1>
+<div class="post-meta">By <a href="/a/jane">Jane Doe</a> · April 12, 2024</div>
+<div class="entry-content">{paragraphs}<div class="share-buttons"><a href="/t">Twitter</a> <a href="/f">Facebook</a></div></div></article>
+<section class="comments">{comments}</section>
+<aside class="sidebar"><div class="widget"><ul>{popular}</ul></div><form><input type="email"><button>Subscribe</button></form></aside></div>
+<footer class="site-footer"><p>&copy; 2024 SecNews. Privacy Policy | Terms of Service | Contact Us</p></footer>
+<script src="/analytics.js"></script><script>{tracking}</script><!-- page generated in 0.12s --></body></html>'''
+PARAGRAPH = ('<p>Palo Alto Networks warned that a critical command injection vulnerability, tracked as CVE-2024-3400, '
+             'is being actively exploited against GlobalProtect gateways. 攻击者可以在未经身份验证的情况下，以 root 权限在防火墙上执行任意代码。</p>\n')
+
+
+def sample_page(paragraphs=12):
+    return PAGE_TEMPLATE.format(
+        nav=''.join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(30)),
+        paragraphs=PARAGRAPH * paragraphs,
+        comments=''.join(f'<div class="comment"><p>Comment {i}: thanks for sharing, we patched our firewalls today.</p></div>' for i in range(20)),
+        popular=''.join(f'<li><a href="/popular/{i}">Popular story number {i} about ransomware and zero-days</a></li>' for i in range(15)),
+        tracking='(function(){var s=document.createElement("script");s.src="https://ads.example.com/ad.js";})();' * 40,
+    )
+
+
+def legacy_clean_html(html_content):
+    '旧的 utils.clean_html，BeautifulSoup 建树后逐个标签 find_all + decompose，只用于对比'
+    soup = BeautifulSoup(html_content, "html.parser")
+    for name in ["script", "style", "img", "a", "video", "audio", "iframe", "input"]:
+        for tag in soup.find_all(name):
+            tag.decompose()
+    return soup.get_text()
+
+
+def legacy_clean_content(content):
+    '旧的四遍清理，只用于对比'
+    content = content.replace('\t', '    ')
+    content = ' '.join(content.split())
+    content = re.sub(r'\u001b\[[0-9;]*[a-zA-Z]', '', content)
+    content = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', content)
+    return content
+
+
+def legacy_remove_control_characters(s):
+    '旧的实现，每次调用都重新拼接并编译正则，只用于对比'
+    control_chars = ''.join(map(chr, range(0, 32))) + chr(127)
+    control_char_re = re.compile('[%s]' % re.escape(control_chars))
+    return control_char_re.sub('', s)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the text processing used on article content and feed output.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--size', type=int, default=512, help='Size of the generated HTML bodies in KB')
+        parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of runs per measurement')
+        parser.add_argument('-p', '--page', action='append', default=[], help='HTML page saved from a feed article to measure main content extraction on, can be repeated')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        pages = [open(path, encoding='utf-8', errors='replace').read() for path in options['page']] or [sample_page()]
+        self.report_extraction(pages)
+
+        size = options['size'] * 1024
+        bodies = {
+            'ascii': ASCII_BLOCK * (size // len(ASCII_BLOCK) + 1),
+            'cjk': CJK_BLOCK * (size // len(CJK_BLOCK) + 1),
+        }
+        article = ARTICLE_BLOCK * (size // len(ARTICLE_BLOCK.encode()) + 1)
+        label = f'html to text ({len(article) // 1024} KB)'
+        if html_text.html_to_text_python(article) != legacy_clean_html(article):
+            self.stdout.write(self.style.WARNING('html.parser extractor output differs from BeautifulSoup'))
+        self.compare(f'{label}, html.parser', lambda: legacy_clean_html(article), lambda: html_text.html_to_text_python(article))
+        if html_text.lxml is not None:
+            self.compare(f'{label}, lxml', lambda: legacy_clean_html(article), lambda: html_text.html_to_text_lxml(article))
+
+        titles = [block.split('<h2>')[1].split('</h2>')[0] + '\x07' for block in (ASCII_BLOCK, CJK_BLOCK)]
+
+        for name, body in bodies.items():
+            self.compare(f'clean_content ({name}, {len(body) // 1024} KB)',
+                         lambda: legacy_clean_content(body), lambda: clean_content(body))
+            self.compare(f'remove_control_characters ({name}, {len(body) // 1024} KB)',
+                         lambda: legacy_remove_control_characters(body), lambda: remove_control_characters(body))
+        self.compare('remove_control_characters (1000 titles)',
+                     lambda: [legacy_remove_control_characters(title) for title in titles * 500],
+                     lambda: [remove_control_characters(title) for title in titles * 500])
+
+    def report_extraction(self, pages):
+        '正文提取前后保存的字节数，以及生成 summary 时送给 LLM 的文字和 token 数'
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'tiktoken encoding unavailable, skipping token counts: {str(e)}'))
+            encoding = None
+        rows = {'stored bytes per article': [0, 0], 'summary input characters per article': [0, 0]}
+        if encoding:
+            rows['summary tokens per article'] = [0, 0]
+        for page in pages:
+            for i, stored in enumerate([clean_content(page), clean_content(extract_main_content(page))]):
+                text = html_text.html_to_text(stored)
+                rows['stored bytes per article'][i] += len(stored.encode())
+                rows['summary input characters per article'][i] += len(text)
+                if encoding:
+                    rows['summary tokens per article'][i] += len(encoding.encode(text))
+        for label, (before, after) in rows.items():
+            self.stdout.write(f'{label:<50} page   {before / len(pages):9.0f}      extracted {after / len(pages):9.0f}      '
+                              f'-{100 - after * 100 / before:.0f}%')
+        elapsed = self.measure(lambda: [extract_main_content(page) for page in pages])
+        self.stdout.write(f'{"main content extraction time per page":<50} {elapsed * 1000 / len(pages):.3f} ms')
+
+    def measure(self, func):
+        'Returns: 单次运行的最短耗时（秒）'
+        return min(timeit.repeat(func, number=1, repeat=self.repeat))
+
+    def compare(self, label, legacy, current):
+        before = self.measure(legacy)
+        after = self.measure(current)
+        self.stdout.write(f'{label:<50} legacy {before * 1000:9.3f} ms   current {after * 1000:9.3f} ms   x{before / after:.1f}')
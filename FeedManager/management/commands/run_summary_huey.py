@@ -0,0 +1,24 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+from huey.consumer_options import ConsumerConfig
+
+
+class Command(BaseCommand):
+    help = 'Run the consumer of the summary queue (settings.SUMMARY_HUEY), separate from run_huey.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-w', '--workers', type=int, default=settings.SUMMARY_WORKERS, help='Number of worker threads')
+
+    def handle(self, *args, **options):
+        # summarize_article_task 定义在 tasks.py 中，导入后才注册到 SUMMARY_HUEY
+        autodiscover_modules('tasks')
+        config = ConsumerConfig(workers=options['workers'], worker_type='thread', periodic=False)
+        config.validate()
+        logger = logging.getLogger('huey')
+        if not logger.handlers:
+            config.setup_logger(logger)
+        consumer = settings.SUMMARY_HUEY.create_consumer(**config.values)
+        consumer.run()
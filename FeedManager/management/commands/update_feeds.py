@@ -1,264 +1,473 @@
 from django.core.management.base import BaseCommand, CommandError
 from FeedManager.models import ProcessedFeed, OriginalFeed, Article
 import feedparser
-from datetime import datetime
-import pytz
-import re
 import os
 from django.conf import settings
 from django.utils import timezone
-from FeedManager.utils import passes_filters, match_content, generate_untitled, clean_url, generate_summary
+from FeedManager.utils import passes_filters, invalidate_filter_plans, field_values, save_dirty_fields
+from FeedManager.fetcher import fetch_feeds, fetch_pages, parse_http_date, FETCH_CONCURRENCY
+from FeedManager.scheduler import is_due, schedule_next_poll
+from FeedManager import circuit_breaker
+from FeedManager.entry import Entry
+from FeedManager.sanitizer import clean_content
+from FeedManager.entry_index import KnownEntryIndex
+from FeedManager.extractor import extract_main_content, EXTRACT_MAIN_CONTENT, KEEP_RAW_PAGE
+from FeedManager.persistence import WriteBehindQueue
+from FeedManager.routing import RoutingIndex
+from FeedManager.summarizer import executor as summary_executor, request_summary, apply_summary, SUMMARY_FIELDS, SUMMARY_QUEUE
+from FeedManager.tasks import summarize_article_task
 import logging
-from django.db import transaction
-import requests
-from fake_useragent import UserAgent
 import httpx
 import time
-import json
 from datetime import timedelta
+from collections import Counter, defaultdict
 
 logger = logging.getLogger('feed_logger')
 
+# 每轮可能变化的 original feed 状态字段，只保存其中有变化的
+SOURCE_STATE_FIELDS = ['valid', 'etag', 'last_modified_header', 'last_modified', 'content_hash',
+                       'next_poll', 'poll_interval', 'not_modified_count', 'failure_count', 'retry_at']
+# 决定下次拉取是否返回 not modified 的字段
+VALIDATOR_FIELDS = ['etag', 'last_modified_header', 'last_modified', 'content_hash']
 
-def fetch_feed(url: str, last_modified: datetime):
-    '拉取单个 original feed 的更新'
-    logger.debug(f'                [*] fetch feed for {url}')
-    headers = {}
-    ua = UserAgent()
-    # Try comment out the following line to see if it works
-    if last_modified:
-        headers['If-Modified-Since'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
-    headers['User-Agent'] = ua.random.strip()
-    try:
-#        print(time.time())
-        response = requests.get(url, headers=headers, timeout=30)
-#        print(time.time())
-        if response.status_code == 200:
-            feed = feedparser.parse(response.text)
-            logger.debug(f"                [*] Response status: {response.status_code}, Headers: {response.headers}")
-            # todo 需要丰富判断逻辑，安全客没有设置Last-Modified，每次都是200导致反复读取数据库
-            
-            # 处理源未正常返回304的情况，如果和上次更新时间一样就返回not modified
-            last_modified_key = 'Last-Modified' if ('api.anquanke.com' not in url and 'therecord.media' not in url) else 'Date' # 安全客的key不标准
-            if last_modified and response.headers.get(last_modified_key):
-                last_modified_response = datetime.strptime(response.headers.get(last_modified_key), '%a, %d %b %Y %H:%M:%S GMT').replace(tzinfo=pytz.UTC)
-                logger.debug(f"                [*] 源的更新时间: {last_modified_response}")
-                logger.debug(f"                [*] feed的上次更新时间: {last_modified}")
-                logger.debug(f"                [*] 分钟级对比 上次: {last_modified.strftime('%Y-%m-%d %H:%M')}   最新: {last_modified_response.strftime('%Y-%m-%d %H:%M')}")
-                if last_modified.strftime('%Y-%m-%d %H:%M') == last_modified_response.strftime('%Y-%m-%d %H:%M'): # 对比分钟级时间是否相同，因为安全客每时每刻都在刷新Last-Modified字段
-                    logger.debug(f"                [*] 内容没有更新")
-                    return {'feed': None, 'status': 'not_modified', 'last_modified': response.headers.get(last_modified_key)}
-
-            # # 处理源未正常返回304的情况，根据processed feed的上次更新时间和当前时间判断，这样也有问题，processed feed是所有feed的最早更新时间，和当前的时间当然差大于1分钟。
-            # if last_modified :
-            #     logger.debug(f"                [*] 现在的时间: {timezone.now()}")
-            #     logger.debug(f"                [*] processed feed的上次更新时间: {last_modified}")
-            #     logger.debug(f"                [*] 时间差: {timezone.now() - last_modified}")
-            #     logger.debug(f"                [*] 距离上次更新不到1分钟 暂不更新")
-            #     if (timezone.now() - last_modified < timedelta(minutes=1)):
-            #         return {'feed': None, 'status': 'not_modified', 'last_modified': response.headers.get('Last-Modified')}
-
-            return {'feed': feed, 'status': 'updated', 'last_modified': response.headers.get(last_modified_key)}
-        elif response.status_code == 304:
-            # ! Why is it taking so long to show not_modified? 8 seconds
-            # Maybe it's because of the User-Agent or the If-Modified-Since header?
-            #print(time.time())
-            return {'feed': None, 'status': 'not_modified', 'last_modified': response.headers.get('Last-Modified')}
-        else:
-            logger.error(f'                [*] Failed to fetch feed {url}: {response.status_code}')
-            return {'feed': None, 'status': 'failed'}
 
-    except Exception as e:
-        logger.error(f'                [*] Failed to fetch feed {url}: {str(e)}')
-        return {'feed': None, 'status': 'failed'}
+def insert_articles(original_feed_id, batch):
+    '在写线程中执行：写入一个源的一批新文章，返回 ({link: pk}, 耗时)'
+    start = time.monotonic()
+    Article.objects.bulk_create(batch, ignore_conflicts=True)
+    pks = dict(
+        Article.objects.filter(original_feed_id=original_feed_id, link__in=[article.link for article in batch])
+        .values_list('link', 'pk')
+    )
+    return pks, time.monotonic() - start
+
 
 class Command(BaseCommand):
     help = 'Updates and processes RSS feeds based on defined schedules and filters.'
 
     def add_arguments(self, parser):
         parser.add_argument('-n', '--name', type=str, help='Name of the ProcessedFeed to update')
+        parser.add_argument('--force', action='store_true', help='Fetch all original feeds, ignoring their polling schedule')
+        parser.add_argument('-c', '--concurrency', type=int, default=FETCH_CONCURRENCY, help='Maximum number of original feeds fetched at the same time')
 
     def handle(self, *args, **options):
         feed_name = options.get('name')
+        self.concurrency = options.get('concurrency') or FETCH_CONCURRENCY
+        # 指定了单个 feed 时（保存 feed、后台手动更新）不考虑拉取计划
+        self.force = options.get('force') or bool(feed_name)
         if feed_name:
             try:
                 feed = ProcessedFeed.objects.get(name=feed_name)
                 logger.info(f'[start] Processing single feed: {feed.name} at {timezone.now()}')
-                self.update_feed(feed)
+                # 只拉取这个 feed 的源；拉取后源的校验值和已知 entry 索引都会前进，
+                # 所以 entry 也要交给订阅了这些源的其他 processed feed，否则只有它们接收的 entry 会永远丢失
+                source_ids = set(feed.feeds.values_list('id', flat=True))
+                processed_feeds = list(ProcessedFeed.objects.filter(feeds__in=source_ids).distinct().prefetch_related('feeds'))
+                self.update_feeds(processed_feeds, source_ids)
             except ProcessedFeed.DoesNotExist:
                 raise CommandError('[ end ] ProcessedFeed "%s" does not exist' % feed_name)
             except Exception as e:
                 logger.error(f'[ end ] Error processing feed {feed_name}: {str(e)}')
         else:
-            processed_feeds = ProcessedFeed.objects.all()
-            for feed in processed_feeds:
-                try:
-                    logger.info(f'[start] Processing feed: {feed.name} at {timezone.now()}')
-                    self.update_feed(feed)
-                    logger.info(f'[ end ] Processing feed: {feed.name} at {timezone.now()}')
-                except Exception as e:
-                    logger.error(f'[ end ]Error processing feed {feed.name}: {str(e)}')
-                    continue  # make sure to continue to the next feed
+            processed_feeds = list(ProcessedFeed.objects.prefetch_related('feeds'))
+            self.update_feeds(processed_feeds)
+
+    def plan_cycle(self, processed_feeds, source_ids=None):
+        '''
+        本轮更新计划：收集所有 processed feed 用到的 original feed 并去重，
+        被多个 processed feed 共用的源只拉取、解析一次；没到拉取时间的源（见 scheduler.py）
+        和处于熔断状态的源（见 circuit_breaker.py）跳过。给了 source_ids 时只拉取其中的源。
+        Returns:
+            {original_feed.id: original_feed}
+        '''
+        now = self.cycle_started = timezone.now()
+        original_feeds = {}
+        skipped = set()
+        broken = set()
+        for feed in processed_feeds:
+            for original_feed in feed.feeds.all():
+                if original_feed.id in original_feeds or original_feed.id in skipped or original_feed.id in broken:
+                    continue
+                if source_ids is not None and original_feed.id not in source_ids:
+                    continue
+                if circuit_breaker.is_open(original_feed, now):
+                    broken.add(original_feed.id)
+                elif self.force or is_due(original_feed, now):
+                    original_feeds[original_feed.id] = original_feed
+                else:
+                    skipped.add(original_feed.id)
+        logger.info(f'[plan ] {len(original_feeds)} unique original feeds due for {len(processed_feeds)} processed feeds, '
+                    f'{len(skipped)} not due yet, {len(broken)} skipped by circuit breaker')
+        return original_feeds
+
+    def update_feeds(self, processed_feeds, source_ids=None):
+        '''
+        feeds : 本轮需要更新的 processed_feed 列表，所有写库操作交给单独的写线程（见 persistence.py）
+        source_ids : 只拉取这些 original feed，None 表示全部
+        '''
+        self.writer = WriteBehindQueue().start()
+        try:
+            self.run_cycle(processed_feeds, source_ids)
+        finally:
+            self.writer.close()
+
+    def run_cycle(self, processed_feeds, source_ids=None):
+        # filter 可能在别的进程（admin）里改过，信号清不到这里的缓存，每轮重新编译一次
+        invalidate_filter_plans()
+        self.original_feeds = self.plan_cycle(processed_feeds, source_ids)
+        fetch_results = fetch_feeds(self.original_feeds.values(), self.concurrency)
+        self.sources = {}
+        self.stats = Counter()
+        self.unsettled = defaultdict(set)  # {original_feed.id: 本轮处理失败、下轮需要重试的 clean_url}
+        self.failed_sources = set()  # 所在 processed feed 整体处理失败的源，本轮不更新已知 entry 索引
+        self.stored_links = {}  # {original_feed.id: 本轮 entry 中已经入库的 clean_url}，见 stored_links_for
+        self.source_values = {}  # {original_feed.id: 本轮开始时源的状态}，见 save_sources
+        for original_feed_id, original_feed in self.original_feeds.items():
+            feed_data = fetch_results[original_feed_id]
+            if 'hash_hit' in feed_data:
+                self.stats['content_hash_hit' if feed_data['hash_hit'] else 'content_hash_miss'] += 1
+            original_values = self.source_values[original_feed_id] = field_values(original_feed, SOURCE_STATE_FIELDS)
+            try:
+                self.sources[original_feed_id] = self.ingest_source(original_feed, feed_data)
+            except Exception as e:
+                # 一个源的异常数据不影响其他源；不保存这次的校验值和 content hash，下轮重新拉取、解析
+                logger.error(f'                [-] Failed to process feed {original_feed.url}: {str(e)}', exc_info=True)
+                for name, value in original_values.items():
+                    setattr(original_feed, name, value)
+                feed_data['status'] = 'failed'
+                self.sources[original_feed_id] = {'entries': [], 'last_modified': None}
+            self.stats[feed_data['status']] += 1
+            feed_data['feed'] = None  # entry 已经转成 Entry，尽早释放 FeedParserDict
+            schedule_next_poll(original_feed, feed_data['status'], self.sources[original_feed_id].get('fetched', ()),
+                               self.cycle_started)
+            if feed_data['status'] == 'failed':
+                circuit_breaker.record_failure(original_feed)
+            else:
+                circuit_breaker.record_success(original_feed)
+        logger.info(f"[stats] updated: {self.stats['updated']}, not modified: {self.stats['not_modified']}, failed: {self.stats['failed']}, "
+                    f"content hash hit/miss: {self.stats['content_hash_hit']}/{self.stats['content_hash_miss']}, "
+                    f"known entries skipped: {self.stats['known_entries']}/{self.stats['fetched_entries']}")
+
+        self.router = RoutingIndex(processed_feeds)
+        self.routes = {}  # {id(entry): 可能接收 entry 的 processed feed id}，同一个 entry 只路由一次
+        self.pending_summaries = []  # [(article, future)]，所有 processed feed 的 summary 请求并行进行，见 apply_summaries
+
+        self.selected = set()  # 本轮已经被某个 processed feed 选中的 (original_feed.id, clean_url)，见 select_new_entries
+        selections = []
+        for feed in processed_feeds:
+            try:
+                logger.info(f'[start] Processing feed: {feed.name} at {timezone.now()}')
+                selections.append((feed, self.update_feed(feed)))
+            except Exception as e:
+                logger.error(f'[ end ]Error processing feed {feed.name}: {str(e)}')
+                self.failed_sources.update(original_feed.id for original_feed in feed.feeds.all())
+                continue  # make sure to continue to the next feed
+
+        # 第一步：补全原文，本轮所有 processed feed 的新文章一起拉取，共用一个客户端的连接池
+        contents, raw_pages = self.fetch_contents([item for _, new_entries in selections for item in new_entries])
+        start = 0
+        for feed, new_entries in selections:
+            end = start + len(new_entries)
+            try:
+                self.store_feed(feed, new_entries, contents[start:end], raw_pages[start:end])
+                logger.info(f'[ end ] Processing feed: {feed.name} at {timezone.now()}')
+            except Exception as e:
+                logger.error(f'[ end ]Error processing feed {feed.name}: {str(e)}')
+                self.failed_sources.update(original_feed.id for original_feed in feed.feeds.all())
+            start = end
+        self.apply_summaries()
+
+        for original_feed_id, source in self.sources.items():
+            if 'index' in source and original_feed_id not in self.failed_sources:
+                source['index'].update(source['fetched'], self.unsettled[original_feed_id])
+        self.save_sources()
+        logger.info(f"[stats] routing skipped {self.stats['routed_out']}/{self.stats['routed_entries']} feed filter checks")
+        if self.stats['page_bytes']:
+            logger.info(f"[stats] main content extraction kept {self.stats['extracted_bytes'] / 1024:.0f} KB "
+                        f"of {self.stats['page_bytes'] / 1024:.0f} KB fetched pages")
+        logger.info(f"[stats] inserted {self.stats['inserted_articles']} articles, "
+                    f"existence lookups took {self.stats['lookup_seconds']:.3f}s, inserts took {self.stats['insert_seconds']:.3f}s")
+
+    def save_sources(self):
+        '''
+        一个源的状态只更新一次，只写有变化的字段，由写线程和其他写操作一起批量提交。
+        有 entry 本轮没处理成功的源保留上次的校验值和 content hash，否则下次拉取返回 not modified，这些 entry 不会再重试。
+        '''
+        for original_feed_id, original_feed in self.original_feeds.items():
+            original_values = self.source_values[original_feed_id]
+            if self.unsettled[original_feed_id] or original_feed_id in self.failed_sources:
+                logger.info(f'            [*] Keeping the previous validators of {original_feed.url} to retry unsettled entries')
+                for name in VALIDATOR_FIELDS:
+                    setattr(original_feed, name, original_values[name])
+            self.writer.submit(save_dirty_fields, original_feed, original_values)
+
+    def ingest_source(self, original_feed, feed_data):
+        '''
+        处理单个 original feed 的拉取结果，更新其状态（由调用方保存）
+        Returns:
+            {'entries': 最新的 max_articles_to_keep 条 entry 中还没处理过的, 'last_modified': 源的更新时间,
+             'fetched': 最新的 max_articles_to_keep 条 entry, 'index': 源的 KnownEntryIndex}，entry 都是 Entry
+        '''
+        source = {'entries': [], 'last_modified': None}
+        if feed_data['status'] == 'updated':
+            original_feed.valid = True
+            logger.debug(f'                [*] Feed {original_feed.url} updated, the new modified time is {feed_data["last_modified"]}')
+            # 保存源返回的原始校验值，下次原样带回
+            original_feed.etag = feed_data['etag']
+            original_feed.last_modified_header = feed_data['last_modified']
+            original_feed.last_modified = parse_http_date(feed_data['last_modified'])
+            original_feed.content_hash = feed_data['content_hash']
+            source['last_modified'] = original_feed.last_modified
+
+            parsed_feed = feed_data['feed']
+            # first sort by published date, then only process the most recent max_articles_to_keep articles
+            if parsed_feed.entries:
+                parsed_feed.entries.sort(key=lambda x: x.get('published_parsed') or (), reverse=True)
+                source['fetched'] = [Entry.from_feedparser(entry, original_feed.id)
+                                     for entry in parsed_feed.entries[:original_feed.max_articles_to_keep]]
+                # 丢弃已经处理过的 entry，不再做 filter 和数据库查询
+                source['index'] = KnownEntryIndex(original_feed.id)
+                source['entries'] = [entry for entry in source['fetched'] if not source['index'].is_known(entry)]
+                self.stats['fetched_entries'] += len(source['fetched'])
+                self.stats['known_entries'] += len(source['fetched']) - len(source['entries'])
+        elif feed_data['status'] == 'not_modified':
+            original_feed.valid = True
+            original_feed.etag = feed_data['etag']
+            original_feed.last_modified_header = feed_data['last_modified']
+            original_feed.content_hash = feed_data['content_hash']
+            logger.debug(f'                [-] Feed {original_feed.url} not modified')
+            logger.debug(f'                [-] Feed {original_feed.url} modified time is {feed_data["last_modified"]}')
+        elif feed_data['status'] == 'failed':
+            logger.error(f'                [-] Failed to fetch feed {original_feed.url}')
+            original_feed.valid = False
+        return source
 
     def update_feed(self, feed):
-        'feed : 处理的是processed_feed '
-        self.current_n_processed = 0
+        '''
+        feed : 处理的是processed_feed，entry 来自本轮已经拉取好的 self.sources
+        Returns:
+            [(entry, original_feed)]，通过 feed_filter 且还没入库的新 entry，原文在 run_cycle 中统一补全
+        '''
         entries = []
         current_modified = feed.last_modified
         min_new_modified = None
         logger.debug(f'            [*] update_feed start   Current last modified: {current_modified} for feed {feed.name}')
-        for original_feed in feed.feeds.all():
-            feed_data = fetch_feed(original_feed.url, original_feed.last_modified)
-
+        for original_feed_id in [original_feed.id for original_feed in feed.feeds.all()]:
+            if original_feed_id not in self.sources:
+                continue  # 本轮没有拉取这个源
+            original_feed = self.original_feeds[original_feed_id]
+            source = self.sources[original_feed_id]
             # update feed.last_modified based on earliest last_modified of all original_feeds
-            if feed_data['status'] == 'updated':
-                original_feed.valid = True
-                original_feed.save()
-                logger.debug(f'                [*] Feed {original_feed.url} updated, the new modified time is {feed_data["last_modified"]}')
-                # 更新 original_feed 的 last_modified   
-                
-                original_feed.last_modified = datetime.strptime(feed_data['last_modified'], '%a, %d %b %Y %H:%M:%S GMT').replace(tzinfo=pytz.UTC) if feed_data['last_modified'] else None
-                original_feed.save()
-                
-                new_modified = datetime.strptime(feed_data['last_modified'], '%a, %d %b %Y %H:%M:%S GMT').replace(tzinfo=pytz.UTC) if feed_data['last_modified'] else None
-                if new_modified and (not min_new_modified or new_modified < min_new_modified):
-                    # 使用多个源中最早的时间做为last_modified，为了确保不会遗漏任何更新。
-                    min_new_modified = new_modified
-
-                parsed_feed = feed_data['feed']
-                # first sort by published date, then only process the most recent max_articles_to_keep articles
-                if parsed_feed.entries: 
-                    parsed_feed.entries.sort(key=lambda x: x.get('published_parsed', []), reverse=True)
-                    # self.stdout.write(f'  Found {len(parsed_feed.entries)} entries in feed {original_feed.url}')
-                    entries.extend((entry, original_feed) for entry in parsed_feed.entries[:original_feed.max_articles_to_keep])
-            elif feed_data['status'] == 'not_modified':
-                original_feed.valid = True
-                original_feed.save()
-                logger.debug(f'                [-] Feed {original_feed.url} not modified')
-                logger.debug(f'                [-] Feed {original_feed.url} modified time is {feed_data["last_modified"]} and the current feed modified time is {current_modified}')
-                continue
-            elif feed_data['status'] == 'failed':
-                logger.error(f'                [-] Failed to fetch feed {original_feed.url}')
-                original_feed.valid = False
-                original_feed.save()
-                continue
+            new_modified = source['last_modified']
+            if new_modified and (not min_new_modified or new_modified < min_new_modified):
+                # 使用多个源中最早的时间做为last_modified，为了确保不会遗漏任何更新。
+                min_new_modified = new_modified
+            entries.extend((entry, original_feed) for entry in source['entries'])
 
-        if min_new_modified:
+        if min_new_modified and min_new_modified != feed.last_modified:
             feed.last_modified = min_new_modified
-            logger.debug(f'            [*] 调用了save函数 for feed {min_new_modified}')
-            feed.save() # 会出现update_feeds任务的重新调用，注意不要出现死循环。
+            logger.debug(f'            [*] 更新 last_modified for feed {min_new_modified}')
+            # 不调用 feed.save()，ProcessedFeed.save 会重新触发 update_feeds 任务
+            self.writer.submit(ProcessedFeed.objects.filter(pk=feed.pk).update, last_modified=min_new_modified)
 
-        entries.sort(key=lambda x: x[0].get('published_parsed', timezone.now().timetuple()), reverse=True)
-        for entry, original_feed in entries: # todo
+        now = timezone.now()
+        entries.sort(key=lambda x: x[0].published or now, reverse=True)
+        # 先检查 filter 再检查数据库
+        accepted = []
+        for entry, original_feed in entries:
             try:
-                self.process_entry(entry, feed, original_feed)
+                self.stats['routed_entries'] += 1
+                if feed.id not in self.route(entry):
+                    self.stats['routed_out'] += 1
+                elif passes_filters(entry, feed, 'feed_filter'):
+                    accepted.append((entry, original_feed))
+            except Exception as e:
+                logger.error(f'                  [-] Failed to process entry: {str(e)}', exc_info=True)
+                self.mark_unsettled(entry, original_feed)
+        return self.select_new_entries(accepted)
+
+    def store_feed(self, feed, new_entries, contents, raw_pages):
+        '存储 processed feed 的新文章，contents 和 raw_pages 是 fetch_contents 的结果，与 new_entries 一一对应'
+        self.current_n_processed = 0
+        articles = []
+        for (entry, original_feed), content, raw_page in zip(new_entries, contents, raw_pages):
+            if content is None:
+                logger.warning(f'                  [-] Skip entry without content, will retry next time: {entry.link}')
+                self.mark_unsettled(entry, original_feed)
+                continue
+            try:
+                articles.append((entry, self.build_article(entry, original_feed, content, raw_page)))
+            except Exception as e:
+                logger.error(f'                  [-] Failed to process entry: {str(e)}', exc_info=True)
+                self.mark_unsettled(entry, original_feed)
+        articles = self.store_articles(articles)
+
+        # 第二步：过滤文章，已经存在 Database 中的文章（非新文章）不会走到这里，不需要浪费 token 总结
+        for entry, article in articles:
+            if self.current_n_processed >= feed.articles_to_summarize_per_interval:
+                break
+            try:
+                if passes_filters(entry, feed, 'summary_filter'):
+                    self.request_summary(article, feed)
+                    self.current_n_processed += 1
             except Exception as e:
-                # logger.error(f'Failed to process entry: {str(e)}')
                 # 把报错的trackback.print_exc()打印出来
-                 logger.error(f'                  [-] Failed to process entry: {str(e)}', exc_info=True)
-                #  logger.error(f'------Failed to process entry: {e.__traceback__}') 
-                #  import sys
-                #  sys.exit(1)
+                logger.error(f'                  [-] Failed to summarize entry: {str(e)}', exc_info=True)
         logger.debug(f'            [*] update_feed end   {feed.name}')
 
-    def process_entry(self, entry, feed, original_feed):
-        '对于 '
-        # 先检查 filter 再检查数据库
-        if passes_filters(entry, feed, 'feed_filter'):
-            existing_article = Article.objects.filter(link=clean_url(entry.link), original_feed=original_feed).first()
-            logger.debug(f'                  [-] Already in db: {entry.title}' if existing_article else f'                  [-] Processing new article: {entry.title}')
-            if not existing_article:
-                # 第一步：补全原文并存储
-                ## 如果原文没爬下来，访问原文补全原文
-                if '安全客' in original_feed.title:
-                    content = (entry.content if 'content' in entry else (entry.description if 'description' in entry else ''))
-                else:
-                    content = (entry.content[0].value if 'content' in entry else (entry.description if 'description' in entry else ''))
-                # todo 定制化
-                if (content == '' or len(content) < 500) and 'TheHackersNews' not in original_feed.url:
-                    ua = UserAgent()
-                    headers = {}
-                    headers['User-Agent'] = ua.random.strip()
-                    logger.debug(f'                    [-] fetch full content for : {entry.link}')
-                    content = requests.get(entry.link, headers=headers, timeout=30).text
-
-                # 清理内容，处理制表符和其他特殊字符
-                content = content.replace('\t', '    ')  # 将制表符替换为4个空格
-                content = ' '.join(content.split())  # 规范化空白字符
-                
-                # 处理自动补全标记
-                content = re.sub(r'\u001b\[[0-9;]*[a-zA-Z]', '', content)  # 移除 ANSI 转义序列
-                content = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', content)     # 移除控制字符
-
-                ## 如果文章不存在，则创建新文章
-                article = Article(
-                    original_feed=original_feed,
-                    title=generate_untitled(entry),
-                    link=clean_url(entry.link),
-                    published_date=datetime(*entry.published_parsed[:6], tzinfo=pytz.UTC) if 'published_parsed' in entry else timezone.now(),
-                    content=content
-                )
-                article.save()
-                # 注意这里的缩进，如果已经存在 Database 中的文章（非新文章），那么就不需要浪费 token 总结了
-#            else:
-#                article = existing_article
-                 # 第二步：过滤文章
-                if self.current_n_processed < feed.articles_to_summarize_per_interval and passes_filters(entry, feed, 'summary_filter'): # and not article.summarized:
-                    
-                    # 第三步：为每篇文章生成summary AI 
-                    logger.info(f'                    [-] 生成 summary for : {article.title}')
-                    # prompt = f"Please summarize this article, and output the result only in JSON format. First item of the json is a one-line summary in 15 words named as 'summary_one_line', second item is the 150-word summary named as 'summary_long', third item is the translated article title as 'title'. Output result in {feed.summary_language} language."
-                    prompt = f"请总结这篇文章，并仅以 JSON 格式输出结果。JSON 的第一项是名为 “summary_one_line” 的 15 字单行总结，第二项是名为 “summary_long” 的 200字以内的总结（也就是summary），第三项是翻译后的文章标题，名为 “title”，第三项是文章标签，名为 “tag”，以中文语言输出结果"
-                    output_mode = 'json'
-                    if feed.additional_prompt:
-                        prompt = f"{ prompt + feed.additional_prompt}"
-                        # output_mode = 'json'
-                    summary_results = generate_summary(article, feed.model, output_mode, prompt, feed.other_model)
-                    # TODO the JSON mode parse is hard-coded as is the default prompt, maybe support automatic json parsing in the future
-                    try:
-                        # article.summary = summary_results # 无论咋样都村summary里
-                        json_result = json.loads(summary_results)
-                        article.summary = json_result['summary_long']
-                        article.summary_one_line = json_result['summary_one_line']
-                        # if feed.translate_title:
-                        article.title = json_result['title']
-                        article.tag = json_result['tag']
-                        article.summarized = True
-                        article.custom_prompt = False
-                        logger.info(f'                    [-] Summary generated for article: {article.title}')
-                        article.save()
-                    except:
-                        article.summary = summary_results
-                        article.summarized = True
-                        article.custom_prompt = True
-                        logger.info(f'                    [-] Summary generated for article: {article.title}')
-                        article.save()
-                    self.current_n_processed += 1
-            # else:
-            #     logger.debug(f'  Already in db: {entry.title}' if existing_article else f'  Processing new article: {entry.title}')
-            #     # 如果已经存在，则更新文章, 存储访问原文链接获取的内容
-            #     if entry.content:
-            #         # logger.info(f' -------- 存储: {entry.link} 的内容')
-            #         existing_article.content = entry.content
-            #         existing_article.save()
-
-    def fetch_feed(self, url):
-        # 对于 feedburner 源特殊处理，hackernews的域名
-        if 'feedburner.com' in url:
-            # 使用内容比较而不是 HTTP 状态码
-            response = requests.get(url)
-            content_hash = hashlib.md5(response.content).hexdigest()
-            
-            # 如果内容没变，模拟 304 响应
-            if content_hash == self.last_content_hash.get(url):
-                return {'status': 'not_modified'}
-            
-            self.last_content_hash[url] = content_hash
-            return {
-                'status': 'updated',
-                'content': response.content,
-                'last_modified': response.headers.get('Last-Modified')
-            }
-        
-        # 其他源使用原来的逻辑
-        return original_fetch_logic(url)
+    def route(self, entry):
+        key = id(entry)  # Entry 在本轮的 self.sources 里一直存在，id 不会被复用
+        if key not in self.routes:
+            self.routes[key] = self.router.candidates(entry)
+        return self.routes[key]
+
+    def mark_unsettled(self, entry, original_feed):
+        '这条 entry 本轮没有处理成功，不记入已知 entry 索引，下轮重试'
+        if entry.url:
+            self.unsettled[original_feed.id].add(entry.url)
+
+    def stored_links_for(self, original_feed):
+        '''
+        original feed 本轮 entry 中已经入库的链接，每个源只用一次 IN 查询，之后在内存中维护
+        '''
+        if original_feed.id not in self.stored_links:
+            links = {entry.url for entry in self.sources[original_feed.id]['entries'] if entry.url}
+            start = time.monotonic()
+            self.stored_links[original_feed.id] = set(
+                Article.objects.filter(original_feed=original_feed, link__in=links).values_list('link', flat=True)
+            )
+            elapsed = time.monotonic() - start
+            self.stats['lookup_seconds'] += elapsed
+            logger.debug(f'            [*] Looked up {len(links)} links of {original_feed.url}, {len(self.stored_links[original_feed.id])} already stored, took {elapsed:.3f}s')
+        return self.stored_links[original_feed.id]
+
+    def select_new_entries(self, accepted):
+        '通过 feed_filter 的 entry 中还没入库、本轮也还没被其他 processed feed 选中的才是需要处理的新文章'
+        new_entries = []
+        for entry, original_feed in accepted:
+            if not entry.url:
+                logger.warning(f'                  [-] Skip entry without link: {entry.title}')
+                continue
+            link = entry.url
+            if link in self.stored_links_for(original_feed) or (original_feed.id, link) in self.selected:
+                logger.debug(f'                  [-] Already in db: {entry.title}')
+                continue
+            logger.debug(f'                  [-] Processing new article: {entry.title}')
+            self.selected.add((original_feed.id, link))
+            new_entries.append((entry, original_feed))
+        return new_entries
+
+    def entry_content(self, entry, original_feed):
+        'feed 中自带的原文'
+        if '安全客' in original_feed.title and entry.has_content:
+            return ''  # 安全客 feed 中的 content 不完整，总是访问原文
+        return entry.content
+
+    def fetch_contents(self, new_entries):
+        '''
+        补全原文：feed 中的原文为空或太短时访问原文链接，本轮所有新文章的原文用一个客户端并发拉取（见 fetcher.fetch_pages）
+        访问原文得到的是整个网页，只保留其中的正文（见 extractor.extract_main_content）
+        Returns:
+            (contents, raw_pages)，都与 new_entries 一一对应：原文，拉取失败的为 None；
+            KEEP_RAW_PAGE 时访问原文得到的整个网页，其他情况为 None
+        '''
+        contents = [self.entry_content(entry, original_feed) for entry, original_feed in new_entries]
+        raw_pages = [None] * len(new_entries)
+        # todo 定制化
+        to_fetch = [i for i, ((entry, original_feed), content) in enumerate(zip(new_entries, contents))
+                    if (content == '' or len(content) < 500) and 'TheHackersNews' not in original_feed.url]
+        if to_fetch:
+            logger.debug(f'                    [-] fetch full content for {len(to_fetch)} entries')
+            pages = fetch_pages([new_entries[i][0].link for i in to_fetch])
+            for i in to_fetch:
+                page = pages.get(new_entries[i][0].link)
+                contents[i] = self.main_content(page) if page is not None else None
+                if KEEP_RAW_PAGE:
+                    raw_pages[i] = page
+        return contents, raw_pages
+
+    def main_content(self, page):
+        if not EXTRACT_MAIN_CONTENT:
+            return page
+        try:
+            content = extract_main_content(page)
+        except Exception as e:
+            logger.warning(f'                    [-] Failed to extract main content, keeping the whole page: {str(e)}')
+            return page
+        self.stats['page_bytes'] += len(page.encode())
+        self.stats['extracted_bytes'] += len(content.encode())
+        return content
+
+    def build_article(self, entry, original_feed, content, raw_page=None):
+        '新文章（未保存），content 是已经补全的原文，raw_page 是访问原文得到的整个网页'
+        # 清理内容：移除 ANSI 转义序列和控制字符，规范化空白字符
+        content = clean_content(content)
+        return Article(
+            original_feed=original_feed,
+            title=entry.title,
+            link=entry.url,
+            published_date=entry.published or timezone.now(),
+            content=content,
+            raw_content=raw_page,
+        )
+
+    def store_articles(self, articles):
+        '''
+        按 original feed 分批 bulk_create 新文章，违反 (link, original_feed) 唯一约束的行直接忽略；
+        SQLite 的 bulk_create 不返回主键，再用一次查询取回主键，供生成 summary 后更新。
+        写入由写线程完成，一个源的一批文章和同一时间提交的其他写操作在一个事务里。
+        Returns:
+            [(entry, article)]，顺序不变，没能入库的被去掉
+        '''
+        by_source = defaultdict(list)
+        for entry, article in articles:
+            by_source[article.original_feed_id].append(article)
+        # 先把所有源的批次都交给写线程，再统一等待结果
+        futures = {original_feed_id: self.writer.submit(insert_articles, original_feed_id, batch)
+                   for original_feed_id, batch in by_source.items()}
+        for original_feed_id, batch in by_source.items():
+            try:
+                pks, elapsed = futures[original_feed_id].result()
+            except Exception as e:
+                logger.error(f'            [*] Failed to store {len(batch)} articles for {self.original_feeds[original_feed_id].url}: {str(e)}', exc_info=True)
+                self.unsettled[original_feed_id].update(article.link for article in batch)
+                continue
+            for article in batch:
+                if article.link in pks:
+                    article.pk = pks[article.link]
+                    article._state.adding = False
+                    article._state.db = Article.objects.db
+            self.stored_links[original_feed_id].update(pks)
+            self.stats['inserted_articles'] += len(batch)
+            self.stats['insert_seconds'] += elapsed
+            logger.info(f'            [*] Stored {len(batch)} new articles for {self.original_feeds[original_feed_id].url} in {elapsed:.3f}s')
+        return [(entry, article) for entry, article in articles if article.pk]
+
+    def request_summary(self, article, feed):
+        '''
+        第三步：为每篇文章生成summary AI。文章已经入库，默认每篇文章一个 summary 队列任务，
+        慢的或失败的 LLM 请求不会拖住本轮更新；SUMMARY_QUEUE=0 时在本轮并行请求，见 apply_summaries
+        '''
+        if SUMMARY_QUEUE:
+            logger.info(f'                    [-] Queued summary for : {article.title}')
+            summarize_article_task(article.pk, feed.pk)
+        else:
+            self.pending_summaries.append((article, request_summary(article, feed)))
+
+    def apply_summaries(self):
+        '等待本轮所有 summary 请求完成，结果写回对应的文章'
+        if not self.pending_summaries:
+            return
+        start = time.monotonic()
+        for article, future in self.pending_summaries:
+            try:
+                self.apply_summary(article, future.result())
+            except Exception as e:
+                logger.error(f'                  [-] Failed to summarize article {article.title}: {str(e)}', exc_info=True)
+        logger.info(f'[stats] generated {len(self.pending_summaries)} summaries in {time.monotonic() - start:.3f}s, '
+                    f'at most {summary_executor.concurrency} requests at a time')
+        self.pending_summaries = []
+
+    def apply_summary(self, article, summary_results):
+        apply_summary(article, summary_results)
+        self.writer.submit(article.save, update_fields=SUMMARY_FIELDS)
@@ -0,0 +1,25 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from FeedManager.tokenizer import configured_models, warm_up
+
+
+class Command(BaseCommand):
+    help = 'Download the tiktoken encodings used for summarization into TIKTOKEN_CACHE_DIR so workers can load them offline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-m', '--model', action='append', default=[], help='Additional model to load the encoding for, can be repeated')
+
+    def handle(self, *args, **options):
+        cache_dir = os.environ.get('TIKTOKEN_CACHE_DIR')
+        if not cache_dir:
+            self.stdout.write(self.style.WARNING('TIKTOKEN_CACHE_DIR is not set, encodings are cached in the system temp directory'))
+        try:
+            encodings = warm_up(configured_models() | set(options['model']))
+        except Exception as e:
+            raise CommandError(f'Failed to load tiktoken encodings: {str(e)}')
+        for name, models in encodings.items():
+            self.stdout.write(self.style.SUCCESS(f'Loaded {name} for {", ".join(models)}'))
+        if cache_dir:
+            self.stdout.write(f'Encodings cached in {cache_dir}')
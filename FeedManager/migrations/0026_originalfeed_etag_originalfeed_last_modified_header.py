@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class AddFieldIfMissing(migrations.AddField):
+    '''
+    init_server 每次启动都会运行 makemigrations，已有的安装可能已经由自动生成的迁移加过这一列（迁移文件不在镜像里），
+    列已经存在时只更新迁移状态，不再建列。
+    '''
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        connection = schema_editor.connection
+        with connection.cursor() as cursor:
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, model._meta.db_table)}
+        if model._meta.get_field(self.name).column in columns:
+            return
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedManager', '0025_alter_filter_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='originalfeed',
+            name='etag',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='originalfeed',
+            name='last_modified_header',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        # 以下是 models.py 早已有、但之前没有提交迁移的改动
+        AddFieldIfMissing(
+            model_name='article',
+            name='tag',
+            field=models.TextField(blank=True, null=True),
+        ),
+        AddFieldIfMissing(
+            model_name='originalfeed',
+            name='last_modified',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        # 只改了 Python 层的默认值和 help_text，数据库不需要变化
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='processedfeed',
+                    name='summary_language',
+                    field=models.CharField(default='Chinese', help_text='Language for summarization, will be ignored if summarization is disabled or using custom prompt.', max_length=20),
+                ),
+                migrations.AlterField(
+                    model_name='processedfeed',
+                    name='translate_title',
+                    field=models.BooleanField(default=True, help_text='If this options is true, Article title is translated to summary language.', verbose_name='Article Title Translation'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedManager', '0026_originalfeed_etag_originalfeed_last_modified_header'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='originalfeed',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedManager', '0027_originalfeed_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='originalfeed',
+            name='next_poll',
+            field=models.DateTimeField(blank=True, default=None, editable=False, help_text='Next time this feed is due for polling.', null=True),
+        ),
+        migrations.AddField(
+            model_name='originalfeed',
+            name='not_modified_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Consecutive polls without new content.'),
+        ),
+        migrations.AddField(
+            model_name='originalfeed',
+            name='poll_interval',
+            field=models.PositiveIntegerField(blank=True, default=None, editable=False, help_text='Current polling interval in seconds.', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedManager', '0028_originalfeed_polling_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='originalfeed',
+            name='failure_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Consecutive failed polls.'),
+        ),
+        migrations.AddField(
+            model_name='originalfeed',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, default=None, editable=False, help_text='Failing feed is skipped until this time.', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedManager', '0029_originalfeed_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='raw_content',
+            field=models.TextField(blank=True, editable=False, help_text='Whole fetched page, kept only when KEEP_RAW_PAGE=1', null=True),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 import re
@@ -23,6 +23,18 @@ class OriginalFeed(models.Model):
     tags = models.ManyToManyField('Tag', related_name='original_feeds', blank=True, help_text="Tags associated with this feed")
     valid = models.BooleanField(default=None, blank=True, null=True, editable=False, help_text="Whether the feed is valid.")
     last_modified = models.DateTimeField(default=None, blank=True, null=True, editable=False)
+    # 源返回的原始缓存校验值，下次请求时原样带回（If-None-Match / If-Modified-Since）
+    etag = models.CharField(max_length=255, blank=True, default='', editable=False)
+    last_modified_header = models.CharField(max_length=255, blank=True, default='', editable=False)
+    # 上次响应内容的摘要，用于识别不返回 304 但内容没变的源
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # 自适应拉取计划，见 scheduler.py
+    next_poll = models.DateTimeField(default=None, blank=True, null=True, editable=False, help_text="Next time this feed is due for polling.")
+    poll_interval = models.PositiveIntegerField(default=None, blank=True, null=True, editable=False, help_text="Current polling interval in seconds.")
+    not_modified_count = models.PositiveIntegerField(default=0, editable=False, help_text="Consecutive polls without new content.")
+    # 熔断，见 circuit_breaker.py
+    failure_count = models.PositiveIntegerField(default=0, editable=False, help_text="Consecutive failed polls.")
+    retry_at = models.DateTimeField(default=None, blank=True, null=True, editable=False, help_text="Failing feed is skipped until this time.")
     
     def save(self, *args, **kwargs):
         if not self.title:
@@ -91,9 +103,23 @@ class ProcessedFeed(models.Model):
         async_update_feeds_and_digest(self.name)
 
 @receiver(m2m_changed, sender=ProcessedFeed.feeds.through)
-def reset_last_modified(sender, instance, action, **kwargs):
+def reset_last_modified(sender, instance, action, pk_set=None, **kwargs):
     if action in ["post_add", "post_remove", "post_clear"]:
         ProcessedFeed.objects.filter(pk=instance.pk).update(last_modified=None, last_digest=None)
+    if action == "post_add" and pk_set:
+        # 新加入的源对这个 processed feed 来说还没处理过
+        original_feed_ids = pk_set if isinstance(instance, ProcessedFeed) else [instance.pk]
+        recheck_sources(original_feed_ids)
+
+def recheck_sources(original_feed_ids):
+    '''
+    让这些源当前输出的 entry 下一轮重新走一遍 filter：清掉已知 entry 索引，
+    并清掉校验值和 content hash，否则源返回 not modified，entry 根本不会再被处理
+    '''
+    from .entry_index import KnownEntryIndex
+    original_feed_ids = list(original_feed_ids)
+    KnownEntryIndex.invalidate(original_feed_ids)
+    OriginalFeed.objects.filter(pk__in=original_feed_ids).update(etag='', last_modified_header='', content_hash='')
 
 class FilterGroup(models.Model):
     PROCESSED_FEED_CHOICES = (
@@ -150,12 +176,33 @@ class Filter(models.Model):
         self.clean()
         super().save(*args, **kwargs)
 
+@receiver([post_save, post_delete], sender=ProcessedFeed)
+@receiver([post_save, post_delete], sender=FilterGroup)
+@receiver([post_save, post_delete], sender=Filter)
+def invalidate_filter_plan(sender, instance, **kwargs):
+    # 编译好的 FilterPlan 缓存在进程内存里，filter 配置变化时清掉对应 processed feed 的缓存
+    from .utils import invalidate_filter_plans
+    if sender is ProcessedFeed:
+        invalidate_filter_plans(instance.pk)
+        return
+    if sender is FilterGroup:
+        processed_feed_id = instance.processed_feed_id
+    else:
+        # 级联删除时 filter group 可能已经不在了，这时清空全部缓存
+        processed_feed_id = FilterGroup.objects.filter(pk=instance.filter_group_id).values_list('processed_feed_id', flat=True).first()
+    invalidate_filter_plans(processed_feed_id)
+    if processed_feed_id is not None:
+        # 按旧 filter 被拒绝的 entry 也记在已知 entry 索引里，下一轮按新 filter 重新检查
+        recheck_sources(ProcessedFeed.feeds.through.objects.filter(processedfeed_id=processed_feed_id)
+                        .values_list('originalfeed_id', flat=True))
+
 class Article(models.Model):
     original_feed = models.ForeignKey(OriginalFeed, on_delete=models.CASCADE, related_name='articles')
     title = models.CharField(max_length=255)
     link = models.URLField()
     published_date = models.DateTimeField()
     content = models.TextField(blank=True, null=True)
+    raw_content = models.TextField(blank=True, null=True, editable=False, help_text="Whole fetched page, kept only when KEEP_RAW_PAGE=1")
     summary = models.TextField(blank=True, null=True)
     summary_one_line = models.TextField(blank=True, null=True)
     tag = models.TextField(blank=True, null=True)
@@ -0,0 +1,110 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.db import connections, transaction
+
+logger = logging.getLogger('feed_logger')
+
+WRITER_BATCH_SIZE = int(os.environ.get('WRITER_BATCH_SIZE', 200))  # 一个事务最多提交的写操作数
+WRITER_FLUSH_INTERVAL = float(os.environ.get('WRITER_FLUSH_INTERVAL', 0.5))  # 秒，凑批的最长等待时间
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    '''
+    单写线程的持久化队列。SQLite 同一时间只允许一个写事务，多个线程各自写库会互相等待甚至 database is locked，
+    所以拉取、解析的工作者只把写操作（文章插入、feed 状态更新等 callable）提交到这里，
+    由唯一的写线程按批在一个事务里提交，每个操作在自己的 savepoint 里执行，失败不影响同批的其他操作。
+
+    用法：
+        writer = WriteBehindQueue()
+        writer.start()
+        future = writer.submit(func, *args)   # future.result() 在事务提交后才可用
+        writer.flush()                        # 等待已提交的写操作全部落库
+        writer.close()
+    '''
+
+    def __init__(self, batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self.n_operations = 0
+        self.n_transactions = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='rssbrew-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        if self._thread is None:
+            # 没有启动写线程时直接同步执行
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def flush(self):
+        self.submit(lambda: None).result()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        logger.info(f'[stats] writer committed {self.n_operations} operations in {self.n_transactions} transactions')
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is _STOP
+                operations = batch[:-1] if stop else batch
+                if operations:
+                    self._commit(operations)
+                if stop:
+                    return
+        finally:
+            # 写线程自己的数据库连接
+            connections.close_all()
+
+    def _commit(self, operations):
+        results = []
+        try:
+            with transaction.atomic():
+                for func, args, kwargs, future in operations:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.error(f'[writer] Failed to commit {len(operations)} operations: {str(e)}', exc_info=True)
+            results = [(future, None, e) for func, args, kwargs, future in operations]
+        self.n_operations += len(operations)
+        self.n_transactions += 1
+        # 事务提交之后再通知等待者，保证它们能读到已经落库的数据
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
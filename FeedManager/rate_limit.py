@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext
+from urllib.parse import urlsplit
+
+import httpx
+from django.utils.http import parse_http_date_safe
+
+logger = logging.getLogger('feed_logger')
+
+HOST_RATE_LIMIT = float(os.environ.get('HOST_RATE_LIMIT', 2))  # 每个 host 每秒的请求数，0 表示不限制
+HOST_BURST = int(os.environ.get('HOST_BURST', 4))  # 令牌桶容量，允许的瞬时突发请求数
+HOST_MAX_CONNECTIONS = int(os.environ.get('HOST_MAX_CONNECTIONS', 4))  # 每个 host 同时进行的请求数
+RETRY_AFTER_MAX = int(os.environ.get('RETRY_AFTER_MAX', 120))  # Retry-After 不超过这个秒数时等待后重试一次
+RETRY_STATUS_CODES = (429, 503)
+
+
+class HostLimiter:
+    '''
+    按 host 限速：令牌桶限制请求频率，信号量限制同时进行的请求数，
+    收到 429/503 的 Retry-After 后整个 host 暂停到指定时间。
+    令牌桶和暂停时间跨多轮拉取保留；信号量绑定事件循环，换了事件循环就重新创建。
+    '''
+
+    def __init__(self, rate=HOST_RATE_LIMIT, burst=HOST_BURST, max_connections=HOST_MAX_CONNECTIONS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_connections = max_connections
+        self._buckets = {}  # host -> (tokens, updated_at)
+        self._blocked_until = {}  # host -> time.monotonic()
+        self._semaphores = {}
+        self._loop = None
+
+    def _semaphore(self, host):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphores = {}
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_connections)
+        return self._semaphores[host]
+
+    async def _take_token(self, host):
+        while True:
+            now = time.monotonic()
+            wait = self._blocked_until.get(host, 0) - now
+            if wait <= 0:
+                if self.rate <= 0:
+                    return
+                tokens, updated_at = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def slot(self, host):
+        async with self._semaphore(host):
+            await self._take_token(host)
+            yield
+
+    def block(self, host, seconds):
+        self._blocked_until[host] = max(self._blocked_until.get(host, 0), time.monotonic() + seconds)
+
+
+limiter = HostLimiter()
+
+
+def retry_after_seconds(response: httpx.Response):
+    'Retry-After 可以是秒数或 HTTP 日期，无法解析时返回 None'
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return int(value)
+    timestamp = parse_http_date_safe(value) if value else None
+    if timestamp is None:
+        return None
+    return max(timestamp - time.time(), 0)
+
+
+@asynccontextmanager
+async def polite_stream(client: httpx.AsyncClient, url: str, headers=None, semaphore=None):
+    '''
+    在 host 限速下发起流式 GET（用法同 client.stream），所有 feed 和原文的请求都经过这里。
+    semaphore 是调用方的全局并发限制，在拿到 host 的名额之后才占用，等待 host 限速的请求不会占着全局名额。
+    收到 429/503 时按 Retry-After 暂停这个 host，等待时间不超过 RETRY_AFTER_MAX 时重试一次。
+    '''
+    host = urlsplit(url).hostname or ''
+    for attempt in range(2):
+        async with limiter.slot(host), (semaphore or nullcontext()):
+            async with client.stream('GET', url, headers=headers) as response:
+                if response.status_code in RETRY_STATUS_CODES:
+                    delay = retry_after_seconds(response)
+                    if delay is not None:
+                        logger.warning(f'                [*] {host} answered {response.status_code}, pausing it for {delay:.0f}s')
+                        limiter.block(host, delay)
+                        if attempt == 0 and delay <= RETRY_AFTER_MAX:
+                            continue
+                yield response
+                return
@@ -0,0 +1,76 @@
+import logging
+from collections import defaultdict
+
+from FeedManager.utils import FieldMatcher, filter_content, get_filter_plan
+
+logger = logging.getLogger('feed_logger')
+
+
+def required_literals(plan):
+    '''
+    从 processed feed 的 feed_filter 中找出 entry 能通过的必要条件：某个字段包含一组字符串中的至少一个。
+    Returns:
+        [(field, literal)]，entry 一个都不包含时一定通不过；空列表表示一定通不过；
+        None 表示找不到这样的条件（没有 filter、none 组合、正则、长度比较等），只能逐个检查
+    '''
+    if not plan.groups:
+        return None
+    group_literals = [group_required_literals(operator, filters) for operator, filters in plan.groups]
+    if plan.group_relational_operator == 'any':
+        # 任意一组通过即可，每一组都必须有必要条件
+        if any(literals is None for literals in group_literals):
+            return None
+        return [literal for literals in group_literals for literal in literals]
+    elif plan.group_relational_operator == 'all':
+        # 所有组都要通过，取其中一组的条件就够了，选候选字符串最少的一组
+        indexable = [literals for literals in group_literals if literals is not None]
+        return min(indexable, key=len) if indexable else None
+    return None
+
+
+def group_required_literals(operator, filters):
+    if operator == 'any':
+        # 每个 filter 都必须是 contains，否则某个不含字符串的 entry 也可能通过
+        if all(filter.match_type == 'contains' for filter in filters):
+            return [(filter.field, filter.value) for filter in filters]
+    elif operator == 'all':
+        contains = [filter for filter in filters if filter.match_type == 'contains']
+        if contains:
+            # 最长的字符串最少命中
+            filter = max(contains, key=lambda filter: len(filter.value))
+            return [(filter.field, filter.value)]
+    return None
+
+
+class RoutingIndex:
+    '''
+    所有 processed feed 的 feed_filter 合成的路由索引：字段 -> 字符串 -> processed feed 的倒排索引，
+    加上无法索引的 processed feed 列表。每个 entry 每个字段只扫描一遍就得到可能接收它的 processed feed，
+    其余的 processed feed 不用再逐个检查 filter，路由代价随命中的数量增长而不是随订阅数增长。
+    候选只是必要条件，仍然要用 passes_filters 做完整判断。
+    '''
+
+    def __init__(self, processed_feeds):
+        self.fallback = set()
+        self.index = defaultdict(lambda: defaultdict(set))  # {field: {literal: {processed_feed.id}}}
+        for feed in processed_feeds:
+            literals = required_literals(get_filter_plan(feed, 'feed_filter'))
+            if literals is None:
+                self.fallback.add(feed.id)
+                continue
+            for field, literal in literals:
+                self.index[field][literal].add(feed.id)
+        self.matchers = {field: FieldMatcher(list(literals), []) for field, literals in self.index.items()}
+        logger.debug(f'[route] {len(self.fallback)} processed feeds not indexable, '
+                     f'{sum(len(literals) for literals in self.index.values())} literals indexed')
+
+    def candidates(self, entry):
+        'Returns: 可能接收这个 entry 的 processed feed id 集合'
+        candidates = set(self.fallback)
+        for field, matcher in self.matchers.items():
+            content = filter_content(entry, field)
+            if not content.strip():
+                continue  # 和 CompiledFilter.matches 一致，空内容不匹配任何 contains
+            for literal in matcher.hits(content):
+                candidates.update(self.index[field][literal])
+        return candidates
@@ -0,0 +1,33 @@
+import re
+
+# 文本先编码成 UTF-8 再用 bytes.translate 删除控制字符：C0 控制字符和 DEL 在 UTF-8 中是单字节，不会出现在多字节字符内部，
+# 所以逐字节删除是安全的。bytes.translate 是一张 256 项的表，对中文等非 ASCII 文本也比 str.translate 和正则快得多。
+# surrogatepass 让不成对的代理字符原样往返。
+
+ANSI_ESCAPE_RE = re.compile(rb'\x1b\[[0-9;]*[a-zA-Z]')
+
+# feed 输出的标题和描述：去掉 C0 控制字符和 DEL
+CONTROL_BYTES = bytes(range(0x20)) + b'\x7f'
+
+# 文章正文：空白类的控制字符（\t \n \v \f \r \x1c-\x1f）交给 str.split 合并成空格，其余 C0 控制字符和 DEL 直接删除
+CONTENT_CONTROL_BYTES = bytes(range(0x00, 0x09)) + bytes(range(0x0e, 0x1c)) + b'\x7f'
+# C1 控制字符 U+0080-U+009F（U+0085 NEL 是空白，保留）在 UTF-8 中是 \xc2\x80-\xc2\x9f
+C1_CONTROL_RE = re.compile(rb'\xc2[\x80-\x84\x86-\x9f]')
+
+
+def remove_control_characters(s):
+    return s.encode('utf-8', 'surrogatepass').translate(None, CONTROL_BYTES).decode('utf-8', 'surrogatepass')
+
+
+def clean_content(content):
+    '''
+    入库前清理文章正文：去掉 ANSI 转义序列和控制字符，所有空白合并成一个空格。
+    控制字符在合并空白之前去掉，不会留下连续的空格。
+    '''
+    data = content.encode('utf-8', 'surrogatepass')
+    if b'\x1b' in data:
+        data = ANSI_ESCAPE_RE.sub(b'', data)
+    data = data.translate(None, CONTENT_CONTROL_BYTES)
+    if not content.isascii():
+        data = C1_CONTROL_RE.sub(b'', data)
+    return ' '.join(data.decode('utf-8', 'surrogatepass').split())
@@ -0,0 +1,65 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.utils import timezone
+
+logger = logging.getLogger('feed_logger')
+
+ADAPTIVE_POLLING = os.environ.get('ADAPTIVE_POLLING', '1') == '1'  # 设为 0 时每次 CRON 都拉取所有源
+POLL_MIN_INTERVAL = timedelta(minutes=int(os.environ.get('POLL_MIN_INTERVAL', 5)))
+POLL_MAX_INTERVAL = timedelta(minutes=int(os.environ.get('POLL_MAX_INTERVAL', 720)))
+HISTORY_SIZE = 10  # 用最近多少条 entry 估计更新频率
+NOT_MODIFIED_BACKOFF = 1.5  # 每多一次连续的 not_modified，间隔乘以这个系数
+NOT_MODIFIED_BACKOFF_CAP = 6
+
+
+def is_due(original_feed, now=None):
+    'original feed 是否到了下一次拉取的时间'
+    if not ADAPTIVE_POLLING or original_feed.next_poll is None:
+        return True
+    return original_feed.next_poll <= (now or timezone.now())
+
+
+def estimate_post_interval(entries, now=None):
+    '''
+    根据本次拉取到的 entry 的发布时间估计源的平均更新间隔。
+    用源本身的 entry 而不是入库的文章：被 filter 过滤掉的 entry 不入库，但同样说明源更新了。
+    Returns:
+        timedelta，有发布时间的 entry 不足两条时返回 None
+    '''
+    now = now or timezone.now()
+    published_dates = sorted((entry.published for entry in entries if entry.published and entry.published <= now),
+                             reverse=True)[:HISTORY_SIZE]
+    if len(published_dates) < 2:
+        return None
+    return (published_dates[0] - published_dates[-1]) / (len(published_dates) - 1)
+
+
+def schedule_next_poll(original_feed, status, entries=(), now=None):
+    '''
+    根据本次拉取结果计算下一次拉取时间，结果写在 original_feed 上，由调用方保存。
+    entries : 本次拉取到的 entry（Entry），源有更新时用来估计更新间隔
+    now : 本轮开始的时间，和 is_due 用同一个基准，否则拉取耗时会让源错过下一轮
+    有更新时间隔取平均更新间隔的一半；not modified（304 或 content hash 相同）时在上次的间隔上逐步拉长，
+    连续 not_modified 超过 NOT_MODIFIED_BACKOFF_CAP 次后不再拉长；结果限制在 [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL] 之内。
+    '''
+    now = now or timezone.now()
+    previous_interval = timedelta(seconds=original_feed.poll_interval) if original_feed.poll_interval else None
+    if status == 'updated':
+        original_feed.not_modified_count = 0
+        post_interval = estimate_post_interval(entries, now)
+        interval = post_interval / 2 if post_interval else POLL_MIN_INTERVAL
+    elif status == 'not_modified':
+        original_feed.not_modified_count += 1
+        interval = previous_interval or POLL_MIN_INTERVAL
+        if original_feed.not_modified_count <= NOT_MODIFIED_BACKOFF_CAP:
+            interval *= NOT_MODIFIED_BACKOFF
+    else:
+        # 拉取失败由 circuit_breaker 退避，这里保持原来的间隔
+        interval = previous_interval or POLL_MIN_INTERVAL
+    interval = min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+
+    original_feed.poll_interval = int(interval.total_seconds())
+    original_feed.next_poll = now + interval
+    logger.debug(f'                [*] Next poll for {original_feed.url} in {interval} at {original_feed.next_poll}')
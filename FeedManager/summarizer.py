@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+logger = logging.getLogger('feed_logger')
+
+OPENAI_PROXY = os.environ.get('OPENAI_PROXY')
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or 'https://api.openai.com/v1'
+SUMMARY_CONCURRENCY = int(os.environ.get('SUMMARY_CONCURRENCY', 4))  # 同时进行的 LLM 请求数上限
+SUMMARY_QUEUE = os.environ.get('SUMMARY_QUEUE', '1') == '1'  # 新文章的 summary 交给 summary 队列（tasks.summarize_article_task），0 表示在 update_feeds 中生成
+SUMMARY_FIELDS = ['title', 'summary', 'summary_one_line', 'tag', 'summarized', 'custom_prompt']
+
+# prompt = f"Please summarize this article, and output the result only in JSON format. First item of the json is a one-line summary in 15 words named as 'summary_one_line', second item is the 150-word summary named as 'summary_long', third item is the translated article title as 'title'. Output result in {feed.summary_language} language."
+SUMMARY_PROMPT = "请总结这篇文章，并仅以 JSON 格式输出结果。JSON 的第一项是名为 “summary_one_line” 的 15 字单行总结，第二项是名为 “summary_long” 的 200字以内的总结（也就是summary），第三项是翻译后的文章标题，名为 “title”，第三项是文章标签，名为 “tag”，以中文语言输出结果"
+
+JSON_SYSTEM_PROMPT = '''
+                            你是一个用于总结文章的有用助手，输出采用JSON格式，一定要输出纯文本的json格式，使用{做开头，}做结尾，不要有任何其他的用于标注代码块的符号。 eg:
+                            {
+                            "summary_one_line": "新型多态攻击伪装密码管理器作案",
+                            "summary_long": "3月6日，攻击者采用新型多态攻击方式，使用Chrome扩展滥用chrome.management API，冒充合法密码管理器（如1Password），伪造登录页面诱骗用户输入敏感信息。完成钓鱼操作后，恶意扩展恢复原状，致使攻击难以被察觉。研究人员建议谷歌尽快加强防护措施，目前尚无有效对策。",
+                            "title": "恶意Chrome扩展伪装密码管理器实施多态攻击窃取敏感信息",
+                            "tag": "网络攻击"
+                            }
+                            '''
+TEXT_SYSTEM_PROMPT = 'You are a helpful assistant for summarizing article content, designed to output pure and clean json format, do not code block the output using triple backticks.'
+
+
+def resolve_model(model, other_model=''):
+    '选择 other 时使用填写的模型名'
+    return other_model if model == 'other' else model
+
+
+def completion_params(article, model, output_mode='json', prompt=None):
+    '''
+    构造 chat.completions.create 的参数，文章截断到模型的上限以内
+    Returns:
+        参数字典
+    '''
+    from FeedManager.utils import clean_txt_and_truncate  # utils.generate_summary 引用本模块
+    params = {'model': model}
+    if output_mode == 'json':
+        truncated_query = clean_txt_and_truncate(article.content, model, clean_bool=True)
+        params['messages'] = [
+            {'role': 'system', 'content': JSON_SYSTEM_PROMPT},
+            {'role': 'user', 'content': f"<prompt> {prompt}</prompt> \n  <article> {truncated_query}</article> "},
+        ]
+        params['response_format'] = {'type': 'json_object'}
+    else:
+        # HTML 和 md 的请求相同
+        truncated_query = clean_txt_and_truncate(article.content, model, clean_bool=False)
+        params['messages'] = [
+            {'role': 'system', 'content': TEXT_SYSTEM_PROMPT},
+            {'role': 'user', 'content': f"<article> {truncated_query}</article> \n <prompt> {prompt}</prompt>"},
+        ]
+    logger.debug(f"prompt is 【{(prompt or '')[:50]}】 \n.... \n")
+    logger.debug(f"content is 【{truncated_query}】 \n.... \n")
+    return params
+
+
+class SummaryExecutor:
+    '''
+    进程内共享的 LLM 请求执行器：一个后台线程运行事件循环，所有请求共用一个 AsyncOpenAI 客户端（同一个连接池），
+    信号量限制同时进行的请求数。任何线程都可以调用 submit，得到的 Future 在请求完成后可用；
+    一轮更新中所有新文章的 summary 一起提交，并行请求，而不是逐篇等待。
+
+    用法：
+        future = executor.submit(article, model, 'json', prompt)
+        result = future.result()   # 模型的输出，失败时为 None
+    '''
+
+    def __init__(self, concurrency=SUMMARY_CONCURRENCY):
+        self.concurrency = concurrency
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='rssbrew-summarizer', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _get_client(self):
+        # 只在事件循环线程中调用，AsyncOpenAI 的连接池绑定在这个事件循环上
+        if self._client is None:
+            client_params = {'api_key': OPENAI_API_KEY, 'base_url': OPENAI_BASE_URL}
+            if OPENAI_PROXY:
+                client_params['http_client'] = DefaultAsyncHttpxClient(proxy=OPENAI_PROXY)
+            self._client = AsyncOpenAI(**client_params)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def _generate(self, article, params):
+        client = self._get_client()
+        async with self._semaphore:
+            try:
+                completion = await client.chat.completions.create(**params)
+                return completion.choices[0].message.content
+            except Exception as e:
+                logger.error(f'Failed to generate summary for article {article.title}: {str(e)}')
+
+    def submit(self, article, model, output_mode='json', prompt=None, other_model=''):
+        '''
+        提交一个 summary 请求。prompt 的构造和文章截断在调用线程中完成，事件循环线程只负责网络请求。
+        Returns:
+            concurrent.futures.Future，结果是模型的输出；没有配置 API key 或模型、请求失败时为 None
+        '''
+        model = resolve_model(model, other_model)
+        if not model or not OPENAI_API_KEY:
+            logger.warning('  OpenAI API key or model not set, skipping summary generation')
+            future = Future()
+            future.set_result(None)
+            return future
+        try:
+            params = completion_params(article, model, output_mode, prompt)
+        except Exception as e:
+            logger.error(f'Failed to generate summary for article {article.title}: {str(e)}')
+            future = Future()
+            future.set_result(None)
+            return future
+        return asyncio.run_coroutine_threadsafe(self._generate(article, params), self._ensure_loop())
+
+
+executor = SummaryExecutor()
+
+
+def request_summary(article, feed):
+    '''
+    按 processed feed 的模型和附加 prompt 提交一篇文章的 summary 请求，不等待结果
+    Returns:
+        concurrent.futures.Future，结果交给 apply_summary
+    '''
+    logger.info(f'                    [-] 生成 summary for : {article.title}')
+    prompt = SUMMARY_PROMPT
+    output_mode = 'json'
+    if feed.additional_prompt:
+        prompt = f"{ prompt + feed.additional_prompt}"
+    return executor.submit(article, feed.model, output_mode, prompt, feed.other_model)
+
+
+def apply_summary(article, summary_results):
+    '''
+    把模型的输出写到文章的 SUMMARY_FIELDS 上，不保存；输出不是预期的 JSON 时原样存到 summary
+    '''
+    # TODO the JSON mode parse is hard-coded as is the default prompt, maybe support automatic json parsing in the future
+    try:
+        json_result = json.loads(summary_results)
+        article.summary = json_result['summary_long']
+        article.summary_one_line = json_result['summary_one_line']
+        # if feed.translate_title:
+        article.title = json_result['title']
+        article.tag = json_result['tag']
+        article.custom_prompt = False
+    except:
+        article.summary = summary_results
+        article.custom_prompt = True
+    article.summarized = True
+    logger.info(f'                    [-] Summary generated for article: {article.title}')
+
+
+def summarize_article(article, feed):
+    '生成一篇文章的 summary 并保存，summary 队列的任务调用'
+    apply_summary(article, request_summary(article, feed).result())
+    article.save(update_fields=SUMMARY_FIELDS)
@@ -1,4 +1,4 @@
-from huey.contrib.djhuey import periodic_task, task
+from huey.contrib.djhuey import close_db, on_startup, periodic_task, task
 from huey import crontab
 from django.core.management import call_command
 from django.conf import settings
@@ -9,6 +9,18 @@ import time
 from django.core.cache import cache
 
 logger = logging.getLogger('feed_logger')
+summary_huey = settings.SUMMARY_HUEY
+
+@summary_huey.on_startup()
+@on_startup()
+def load_tokenizer():
+    # 镜像中的编码文件由 warm_tokenizer 预先放在 TIKTOKEN_CACHE_DIR，worker 启动时加载，第一次生成 summary 不用再下载
+    from FeedManager.tokenizer import configured_models, warm_up
+    try:
+        encodings = warm_up(configured_models())
+        logger.info(f"Loaded tokenizer encodings: {', '.join(encodings)}")
+    except Exception as e:
+        logger.error(f"Failed to load tokenizer encodings, run manage.py warm_tokenizer with network access: {str(e)}")
 
 CRON = os.getenv('CRON', '0 * * * *')  # default to every hour
 cron_settings = parse_cron(CRON)
@@ -61,4 +73,23 @@ def async_update_feeds_and_digest(feed_name):
 
 @task(retries=0)
 def clean_old_articles(feed_id):
-    call_command('clean_old_articles', feed=feed_id)
\ No newline at end of file
+    call_command('clean_old_articles', feed=feed_id)
+
+@summary_huey.task(retries=0)
+@close_db
+def summarize_article_task(article_id, feed_id):
+    '''
+    summary 队列的任务：为一篇已经入库的文章生成 summary。
+    文章可能已经被 clean_old_articles 删掉，或者已经由另一个 processed feed 的任务总结过。
+    '''
+    from FeedManager.models import Article, ProcessedFeed
+    from FeedManager.summarizer import summarize_article
+    article = Article.objects.filter(pk=article_id, summarized=False).first()
+    feed = ProcessedFeed.objects.filter(pk=feed_id).first()
+    if article is None or feed is None:
+        logger.debug(f"Skip summarize_article_task for article {article_id}: article summarized or removed")
+        return
+    try:
+        summarize_article(article, feed)
+    except Exception as e:
+        logger.error(f"Error in summarize_article_task for article {article_id}: {str(e)}")
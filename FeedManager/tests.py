@@ -1,3 +1,339 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import random
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from FeedManager import circuit_breaker, utils
+from FeedManager.entry import Entry
+from FeedManager.entry_index import KNOWN_ENTRY_GRACE, KnownEntryIndex
+from FeedManager.fetcher import fetch_feed
+from FeedManager.models import Article, OriginalFeed
+from FeedManager.persistence import WriteBehindQueue
+from FeedManager.routing import RoutingIndex
+from FeedManager.utils import CompiledFilter, FieldMatcher, FilterPlan, combine, filter_content
+
+FIELDS = ['title', 'content', 'link', 'title_or_content']
+MATCH_TYPES = ['contains', 'does_not_contain', 'matches_regex', 'does_not_match_regex', 'shorter_than', 'longer_than']
+WORDS = ['CVE', 'cve', 'Patch', 'patch', 'ransomware', '2024', '-', 'http', 'a', 'tem', '', ' ']
+# 包括不能合并的正则：反向引用、全局内联 flag、同名的命名分组
+REGEXES = [r'CVE-\d+', r'(?i)patch', r'^Item', r'(\w)\1', r'(?P<x>e)(?P=x)', r'ware|tem', r'\d$',
+           r'(?P<id>CVE-\d+)', r'(?P<id>GHSA-\w+)', r'\s{2,}']
+TEXTS = ['Item CVE-2024-3400 patched', 'Patch Tuesday fixes 57 flaws', 'ransomware hits hospital', 'GHSA-abcd advisory',
+         'looks  good', 'committee meeting', '', 'https://example.com/cve/2024', 'Other 3']
+FEED_URL = 'https://feeds.example.com/rss.xml'
+FEED_BODY = (b'<?xml version="1.0"?><rss version="2.0"><channel><title>T</title>'
+             b'<item><title>Item CVE-2024-3400</title><link>https://example.com/a/1</link></item></channel></rss>')
+
+
+def random_filter(rng, match_types=MATCH_TYPES):
+    match_type = rng.choice(match_types)
+    if 'contain' in match_type:
+        value = rng.choice(WORDS)
+    elif 'regex' in match_type:
+        value = rng.choice(REGEXES)
+    else:
+        value = str(rng.randint(1, 60))
+    return SimpleNamespace(field=rng.choice(FIELDS), match_type=match_type, value=value)
+
+
+def random_groups(rng, match_types=MATCH_TYPES):
+    return [(rng.choice(['all', 'any', 'none']), [random_filter(rng, match_types) for _ in range(rng.randint(0, 5))])
+            for _ in range(rng.randint(0, 3))]
+
+
+def random_entry(rng):
+    title = ' '.join(rng.sample(TEXTS, rng.randint(0, 2)))
+    text = ' '.join(rng.sample(TEXTS, rng.randint(0, 3)))
+    link = rng.choice(['', 'https://example.com/a', 'https://example.com/cve/2024', 'http://tem.example/2024'])
+    return Entry(title=title, link=link, text=text)
+
+
+def match_content(entry, filter):
+    '单个 filter 单独求值'
+    return CompiledFilter(filter).matches(filter_content(entry, filter.field))
+
+
+def reference_passes(entry, groups, group_relational_operator):
+    '逐个 filter 单独求值，即合并匹配之前的实现'
+    if not groups:
+        return True
+    return combine(group_relational_operator, (
+        combine(operator, (match_content(entry, filter) for filter in filters))
+        for operator, filters in groups
+    ))
+
+
+def compile_plan(groups, group_relational_operator):
+    return FilterPlan([(operator, [CompiledFilter(filter) for filter in filters]) for operator, filters in groups],
+                      group_relational_operator)
+
+
+class FieldMatcherTests(SimpleTestCase):
+
+    def check_hits(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            literals = rng.sample(WORDS, rng.randint(0, 5))
+            patterns = [re.compile(pattern) for pattern in rng.sample(REGEXES, rng.randint(0, 5))]
+            matcher = FieldMatcher(literals, patterns)
+            for content in TEXTS:
+                expected = {literal for literal in literals if literal in content}
+                expected |= {pattern for pattern in patterns if pattern.search(content)}
+                self.assertEqual(matcher.hits(content), expected, (literals, patterns, content))
+
+    def test_hits_match_per_filter_search(self):
+        self.check_hits()
+
+    def test_hits_without_ahocorasick(self):
+        with mock.patch.object(utils, 'ahocorasick', None):
+            self.check_hits()
+
+    def test_duplicate_named_groups(self):
+        # 各自合法的两个正则合并后分组重名，退回逐个匹配
+        matcher = FieldMatcher([], [re.compile(r'(?P<id>CVE-\d+)'), re.compile(r'(?P<id>GHSA-\w+)')])
+        self.assertEqual([pattern.pattern for pattern in matcher.hits('GHSA-abcd advisory')], [r'(?P<id>GHSA-\w+)'])
+
+
+class FilterPlanTests(SimpleTestCase):
+
+    def check_plans(self):
+        rng = random.Random(2)
+        for _ in range(300):
+            groups = random_groups(rng)
+            group_relational_operator = rng.choice(['all', 'any', 'none'])
+            plan = compile_plan(groups, group_relational_operator)
+            for _ in range(10):
+                entry = random_entry(rng)
+                self.assertEqual(plan.passes(entry), reference_passes(entry, groups, group_relational_operator),
+                                 (groups, group_relational_operator, entry))
+
+    def test_plan_matches_per_filter_evaluation(self):
+        self.check_plans()
+
+    def test_plan_without_ahocorasick(self):
+        with mock.patch.object(utils, 'ahocorasick', None):
+            self.check_plans()
+
+
+class RoutingIndexTests(SimpleTestCase):
+
+    def tearDown(self):
+        utils.invalidate_filter_plans()
+
+    def test_candidates_include_every_accepting_feed(self):
+        rng = random.Random(3)
+        # contains 多一些，才有能建索引的 feed
+        match_types = ['contains', 'contains', 'contains', 'does_not_contain', 'matches_regex', 'longer_than']
+        for trial in range(100):
+            utils.invalidate_filter_plans()
+            feeds = []
+            for k in range(5):
+                feed = SimpleNamespace(id=trial * 10 + k, pk=trial * 10 + k)
+                groups = random_groups(rng, match_types)
+                group_relational_operator = rng.choice(['all', 'any', 'none'])
+                utils._filter_plans[(feed.pk, 'feed_filter')] = compile_plan(groups, group_relational_operator)
+                feeds.append((feed, groups, group_relational_operator))
+            router = RoutingIndex([feed for feed, _, _ in feeds])
+            for _ in range(10):
+                entry = random_entry(rng)
+                candidates = router.candidates(entry)
+                for feed, groups, group_relational_operator in feeds:
+                    if reference_passes(entry, groups, group_relational_operator):
+                        self.assertIn(feed.id, candidates, (groups, group_relational_operator, entry))
+
+
+def fetch(handler, **kwargs):
+    '用 handler(request) -> httpx.Response 代替源，拉取一次 FEED_URL'
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await fetch_feed(client, FEED_URL, **kwargs)
+    return asyncio.run(run())
+
+
+class ConditionalFetchTests(SimpleTestCase):
+
+    def test_sends_stored_validators(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(304)
+
+        fetch(handler, etag='"v1"', last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual(requests[0].headers['If-None-Match'], '"v1"')
+        self.assertEqual(requests[0].headers['If-Modified-Since'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+    def test_no_validators_on_first_fetch(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, content=FEED_BODY)
+
+        fetch(handler)
+        self.assertNotIn('If-None-Match', requests[0].headers)
+        self.assertNotIn('If-Modified-Since', requests[0].headers)
+
+    def test_not_modified_keeps_validators(self):
+        result = fetch(lambda request: httpx.Response(304), etag='"v1"', last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual(result['status'], 'not_modified')
+        self.assertEqual(result['etag'], '"v1"')
+        self.assertEqual(result['last_modified'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+    def test_not_modified_echoes_new_validators(self):
+        result = fetch(lambda request: httpx.Response(304, headers={'ETag': '"v2"'}), etag='"v1"')
+        self.assertEqual(result['etag'], '"v2"')
+
+    def test_updated_stores_raw_validators(self):
+        headers = {'ETag': 'W/"v2"', 'Last-Modified': 'Tue, 02 Jan 2024 00:00:00 GMT'}
+        result = fetch(lambda request: httpx.Response(200, headers=headers, content=FEED_BODY), etag='"v1"')
+        self.assertEqual(result['status'], 'updated')
+        self.assertEqual(result['etag'], 'W/"v2"')
+        self.assertEqual(result['last_modified'], 'Tue, 02 Jan 2024 00:00:00 GMT')
+        self.assertEqual(len(result['feed'].entries), 1)
+
+
+class ContentHashTests(SimpleTestCase):
+
+    def test_same_body_is_not_modified(self):
+        content_hash = hashlib.sha256(FEED_BODY).hexdigest()
+        result = fetch(lambda request: httpx.Response(200, content=FEED_BODY), content_hash=content_hash)
+        self.assertEqual(result['status'], 'not_modified')
+        self.assertTrue(result['hash_hit'])
+        self.assertIsNone(result['feed'])
+        self.assertEqual(result['content_hash'], content_hash)
+
+    def test_changed_body_is_parsed(self):
+        result = fetch(lambda request: httpx.Response(200, content=FEED_BODY), content_hash='0' * 64)
+        self.assertEqual(result['status'], 'updated')
+        self.assertFalse(result['hash_hit'])
+        self.assertEqual(result['content_hash'], hashlib.sha256(FEED_BODY).hexdigest())
+
+    def test_not_modified_keeps_hash(self):
+        result = fetch(lambda request: httpx.Response(304), etag='"v1"', content_hash='0' * 64)
+        self.assertEqual(result['content_hash'], '0' * 64)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    now = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+    def test_backoff_doubles_up_to_max(self):
+        with mock.patch.object(circuit_breaker.random, 'random', return_value=1.0):
+            delays = [circuit_breaker.backoff_delay(n) for n in range(1, 5)]
+            self.assertEqual(delays, [circuit_breaker.BREAKER_BASE_DELAY * 2 ** n for n in range(4)])
+            self.assertEqual(circuit_breaker.backoff_delay(50), circuit_breaker.BREAKER_MAX_DELAY)
+
+    def test_backoff_jitter_stays_in_upper_half(self):
+        for n in range(1, 20):
+            delay = min(circuit_breaker.BREAKER_BASE_DELAY * 2 ** (n - 1), circuit_breaker.BREAKER_MAX_DELAY)
+            self.assertTrue(delay / 2 <= circuit_breaker.backoff_delay(n) <= delay)
+
+    def test_long_failing_source_does_not_overflow(self):
+        self.assertLessEqual(circuit_breaker.backoff_delay(10 ** 6), circuit_breaker.BREAKER_MAX_DELAY)
+
+    def test_record_failure_opens_until_retry_at(self):
+        feed = SimpleNamespace(url=FEED_URL, failure_count=0, retry_at=None)
+        self.assertEqual(circuit_breaker.circuit_state(feed, self.now), circuit_breaker.CLOSED)
+        circuit_breaker.record_failure(feed, self.now)
+        self.assertEqual(feed.failure_count, 1)
+        self.assertTrue(self.now < feed.retry_at <= self.now + circuit_breaker.BREAKER_BASE_DELAY)
+        self.assertTrue(circuit_breaker.is_open(feed, self.now))
+        self.assertEqual(circuit_breaker.circuit_state(feed, feed.retry_at + timedelta(seconds=1)), circuit_breaker.HALF_OPEN)
+
+    def test_record_success_closes(self):
+        feed = SimpleNamespace(url=FEED_URL, failure_count=0, retry_at=None)
+        for _ in range(3):
+            circuit_breaker.record_failure(feed, self.now)
+        self.assertEqual(feed.failure_count, 3)
+        circuit_breaker.record_success(feed)
+        self.assertEqual((feed.failure_count, feed.retry_at), (0, None))
+        self.assertEqual(circuit_breaker.circuit_state(feed, self.now), circuit_breaker.CLOSED)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class KnownEntryIndexTests(TestCase):
+
+    def setUp(self):
+        self.source = OriginalFeed.objects.create(url=FEED_URL)
+        self.now = timezone.now()
+
+    def entry(self, n, published=None):
+        return Entry(title=f'Item {n}', link=f'https://example.com/a/{n}', text='', published=published)
+
+    def test_rebuilds_links_from_articles(self):
+        Article.objects.create(original_feed=self.source, title='Item 1', link='https://example.com/a/1', published_date=self.now)
+        index = KnownEntryIndex(self.source.id)
+        self.assertIsNone(index.high_water_mark)
+        self.assertTrue(index.is_known(self.entry(1)))
+        self.assertFalse(index.is_known(self.entry(2)))
+
+    def test_update_remembers_fetched_links(self):
+        entries = [self.entry(n, self.now - timedelta(hours=n)) for n in range(3)]
+        KnownEntryIndex(self.source.id).update(entries)
+        index = KnownEntryIndex(self.source.id)
+        self.assertTrue(all(index.is_known(entry) for entry in entries))
+        self.assertEqual(index.high_water_mark, self.now)
+        self.assertFalse(index.is_known(self.entry(3, self.now - timedelta(hours=1))))
+
+    def test_unsettled_links_are_retried(self):
+        entries = [self.entry(n, self.now) for n in range(3)]
+        KnownEntryIndex(self.source.id).update(entries, unsettled={entries[1].url})
+        index = KnownEntryIndex(self.source.id)
+        self.assertTrue(index.is_known(entries[0]))
+        self.assertFalse(index.is_known(entries[1]))
+
+    def test_entries_older_than_grace_are_known(self):
+        KnownEntryIndex(self.source.id).update([self.entry(0, self.now)])
+        index = KnownEntryIndex(self.source.id)
+        self.assertTrue(index.is_known(self.entry(1, self.now - KNOWN_ENTRY_GRACE - timedelta(hours=1))))
+        self.assertFalse(index.is_known(self.entry(2, self.now - KNOWN_ENTRY_GRACE + timedelta(hours=1))))
+        self.assertFalse(index.is_known(self.entry(3)))
+
+    def test_future_dates_do_not_raise_high_water_mark(self):
+        KnownEntryIndex(self.source.id).update([self.entry(0, self.now), self.entry(1, self.now + timedelta(days=365))])
+        index = KnownEntryIndex(self.source.id)
+        self.assertLessEqual(index.high_water_mark, self.now)
+        self.assertFalse(index.is_known(self.entry(2, self.now - timedelta(hours=1))))
+
+    def test_invalidate(self):
+        KnownEntryIndex(self.source.id).update([self.entry(0, self.now)])
+        KnownEntryIndex.invalidate([self.source.id])
+        index = KnownEntryIndex(self.source.id)
+        self.assertIsNone(index.high_water_mark)
+        self.assertFalse(index.is_known(self.entry(0, self.now)))
+
+
+def broken_operation():
+    raise ValueError('broken operation')
+
+
+class WriteBehindQueueTests(TransactionTestCase):
+    # 写线程用自己的数据库连接，需要真正提交的事务
+
+    def test_failed_operation_does_not_affect_batch(self):
+        writer = WriteBehindQueue(flush_interval=1).start()
+        first = writer.submit(OriginalFeed.objects.create, url='https://example.com/1.xml')
+        broken = writer.submit(broken_operation)
+        duplicate = writer.submit(OriginalFeed.objects.create, url='https://example.com/1.xml')
+        last = writer.submit(OriginalFeed.objects.create, url='https://example.com/2.xml')
+        writer.close()
+        self.assertEqual(writer.n_transactions, 1)
+        self.assertRaises(ValueError, broken.result)
+        self.assertRaises(IntegrityError, duplicate.result)
+        self.assertEqual(first.result().url, 'https://example.com/1.xml')
+        self.assertEqual(last.result().url, 'https://example.com/2.xml')
+        self.assertEqual(sorted(OriginalFeed.objects.values_list('url', flat=True)),
+                         ['https://example.com/1.xml', 'https://example.com/2.xml'])
+
+    def test_submit_without_thread_runs_inline(self):
+        writer = WriteBehindQueue()
+        self.assertEqual(writer.submit(OriginalFeed.objects.count).result(), 0)
+        self.assertRaises(ValueError, writer.submit(broken_operation).result)
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+from functools import lru_cache
+
+import tiktoken
+from django.db import DatabaseError
+
+logger = logging.getLogger('feed_logger')
+
+# 送给模型的文章最多多少 token，留出 prompt 和输出的余量
+DEFAULT_CONTEXT_LIMITS = {
+    'gpt-3.5-turbo': 16200,
+    'gpt-4o': 127800,
+    'gpt-4-turbo': 127800,
+    'gpt-4o-mini': 127800,
+    'default': 127800,  # Default for all other models
+}
+FALLBACK_ENCODING_MODEL = 'gpt-4o'  # tiktoken 不认识的模型用这个模型的编码
+MAX_BYTES_PER_CHAR = 4  # UTF-8 中一个字符最多 4 个字节，而 tiktoken 的每个 token 至少对应一个字节
+
+
+def load_context_limits():
+    '''
+    内置的上限，加上环境变量 MODEL_CONTEXT_LIMITS 中的 JSON（如 {"gpt-4.1": 1000000, "default": 60000}）覆盖的部分
+    '''
+    limits = dict(DEFAULT_CONTEXT_LIMITS)
+    value = os.environ.get('MODEL_CONTEXT_LIMITS')
+    if value:
+        try:
+            limits.update({model: int(limit) for model, limit in json.loads(value).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f'Invalid MODEL_CONTEXT_LIMITS, using the built-in limits: {str(e)}')
+    return limits
+
+
+MODEL_CONTEXT_LIMITS = load_context_limits()
+
+
+def context_limit(model):
+    return MODEL_CONTEXT_LIMITS.get(model, MODEL_CONTEXT_LIMITS['default'])
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    '每个模型的编码只查找一次'
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.encoding_for_model(FALLBACK_ENCODING_MODEL)
+
+
+def encode(text, model):
+    # 文章里出现的 <|endoftext|> 等特殊 token 当作普通文字
+    return get_encoding(model).encode(text, disallowed_special=())
+
+
+def count_tokens(text, model):
+    return len(encode(text, model))
+
+
+def truncate_to_limit(text, model, limit=None):
+    '''
+    把文本截断到模型的 token 上限以内，最多只编码一次；
+    按字符数（再按 UTF-8 字节数）估算出一定不超过上限的文本不编码。
+    Returns:
+        原文或截断后的文本
+    '''
+    limit = limit or context_limit(model)
+    if len(text) * MAX_BYTES_PER_CHAR <= limit or len(text.encode('utf-8', 'surrogatepass')) <= limit:
+        return text
+    tokens = encode(text, model)
+    if len(tokens) <= limit:
+        return text
+    # 截断点可能落在一个多字节字符中间，解码出的替换字符去掉
+    return get_encoding(model).decode(tokens[:limit]).rstrip('\ufffd')
+
+
+def configured_models():
+    '''
+    后台可以选择的模型，加上数据库中填写的 other 模型；数据库不可用时（比如构建镜像时）只返回前者
+    '''
+    from FeedManager.models import ProcessedFeed
+    models = {model for model, _ in ProcessedFeed.choices if model != 'other'}
+    try:
+        for values in ProcessedFeed.objects.values_list('other_model', 'other_digest_model'):
+            models.update(value for value in values if value)
+    except DatabaseError:
+        pass
+    return models
+
+
+def warm_up(models=()):
+    '''
+    预先加载模型用到的 tiktoken 编码。编码文件第一次使用时从网络下载，
+    设置了 TIKTOKEN_CACHE_DIR 时缓存在这个目录，之后离线也能加载。
+    Returns:
+        {编码名: [使用这个编码的模型]}
+    '''
+    models = set(models) | {model for model in MODEL_CONTEXT_LIMITS if model != 'default'} | {FALLBACK_ENCODING_MODEL}
+    encodings = {}
+    for model in sorted(models):
+        encodings.setdefault(get_encoding(model).name, []).append(model)
+    return encodings
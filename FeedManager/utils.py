@@ -1,21 +1,19 @@
 import re
-from bs4 import BeautifulSoup
 import logging
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 import os
-from openai import OpenAI
-import tiktoken
 import time
+from collections import defaultdict
+try:
+    import ahocorasick  # 可选依赖 pyahocorasick，没有安装时用正则交替做预筛
+except ImportError:
+    ahocorasick = None
+from FeedManager.html_text import html_to_text
+from FeedManager.tokenizer import truncate_to_limit
+from FeedManager.sanitizer import remove_control_characters  # noqa: F401 兼容旧的导入位置
+from FeedManager.summarizer import executor as summary_executor
 
 logger = logging.getLogger('feed_logger')
-OPENAI_PROXY = os.environ.get('OPENAI_PROXY')
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
-OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or 'https://api.openai.com/v1'
-
-def remove_control_characters(s):
-    control_chars = ''.join(map(chr, range(0, 32))) + chr(127)
-    control_char_re = re.compile('[%s]' % re.escape(control_chars))
-    return control_char_re.sub('', s)
 
 def clean_url(url):
     parsed_url = urlparse(url)
@@ -52,128 +50,228 @@ def clean_html(html_content):
     """
     This function is used to clean the HTML content.
     It will remove all the <script>, <style>, <img>, <a>, <video>, <audio>, <iframe>, <input> tags.
+    The text is extracted in a single streaming pass, see html_text.html_to_text.
     Returns:
         Cleaned text for summarization
     """
-    soup = BeautifulSoup(html_content, "html.parser")
+    return html_to_text(html_content)
 
-    for script in soup.find_all("script"):
-        script.decompose()
+def clean_txt_and_truncate(query, model, clean_bool=True):
+    cleaned_article = query
+    if clean_bool:
+        cleaned_article = clean_html(query)
+    return truncate_to_limit(cleaned_article, model)
 
-    for style in soup.find_all("style"):
-        style.decompose()
+def field_values(instance, field_names):
+    return {name: getattr(instance, name) for name in field_names}
 
-    for img in soup.find_all("img"):
-        img.decompose()
+def save_dirty_fields(instance, original_values):
+    '''
+    只保存相对 original_values（field_values 的结果）有变化的字段，没有变化时不写数据库
+    Returns:
+        保存了的字段名列表
+    '''
+    changed = [name for name, value in original_values.items() if getattr(instance, name) != value]
+    if changed:
+        instance.save(update_fields=changed)
+    return changed
 
-    for a in soup.find_all("a"):
-        a.decompose()
 
-    for video in soup.find_all("video"):
-        video.decompose()
+def passes_filters(entry, processed_feed, filter_type):
+    'entry 是规范化后的 entry.Entry（见 Entry.from_feedparser / Entry.from_article）'
+    return get_filter_plan(processed_feed, filter_type).passes(entry)
 
-    for audio in soup.find_all("audio"):
-        audio.decompose()
-    
-    for iframe in soup.find_all("iframe"):
-        iframe.decompose()
-    
-    for input in soup.find_all("input"):
-        input.decompose()
 
-    return soup.get_text()
+# {(processed_feed.id, filter_type): FilterPlan}，Filter/FilterGroup/ProcessedFeed 保存或删除时由 models.py 的信号清掉
+_filter_plans = {}
 
-def clean_txt_and_truncate(query, model, clean_bool=True):
-    cleaned_article = query
-    if clean_bool:
-        cleaned_article = clean_html(query)
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except:
-        encoding = tiktoken.encoding_for_model('gpt-4o')
-    token_length = len(encoding.encode(cleaned_article))
-
-    max_length_of_models = {
-        'gpt-3.5-turbo': 16200,
-        'gpt-4o': 127800,
-        'gpt-4-turbo': 127800,
-        'gpt-4o-mini': 127800,
-        'default': 127800  # Default for all other models
-    }
 
-    max_length = max_length_of_models.get(model, max_length_of_models['default'])
+def get_filter_plan(processed_feed, filter_type):
+    key = (processed_feed.pk, filter_type)
+    plan = _filter_plans.get(key)
+    if plan is None:
+        plan = _filter_plans[key] = FilterPlan.compile(processed_feed, filter_type)
+    return plan
 
-    # Truncate the text if it exceeds the model's token limit
-    if token_length > max_length:
-        truncated_article = encoding.decode(encoding.encode(cleaned_article)[:max_length])
-        return truncated_article
-    else:
-        return cleaned_article
 
-def generate_untitled(entry):
-    try: return entry.title
-    except: 
-        try: return entry.article[:50]
-        except: return entry.link
+def invalidate_filter_plans(processed_feed_id=None):
+    'processed_feed_id 为 None 时清空所有缓存的 FilterPlan'
+    if processed_feed_id is None:
+        _filter_plans.clear()
+        return
+    for filter_type in ('feed_filter', 'summary_filter'):
+        _filter_plans.pop((processed_feed_id, filter_type), None)
 
-def passes_filters(entry, processed_feed, filter_type):
-    groups = processed_feed.filter_groups.filter(usage=filter_type)
-    if not groups:
-        return True
-    group_results = []
-    for group in groups:
-        filters = group.filters.all()
-        results = [match_content(entry, filter) for filter in filters]
-        logger.debug(f'  Results for group {group.usage}: {results} for {entry.title} {entry.link}')
-        if group.relational_operator == 'all':
-            group_results.append(all(results))
-        elif group.relational_operator == 'any':
-            group_results.append(any(results))
-        elif group.relational_operator == 'none':
-            group_results.append(not any(results))
-    if filter_type == 'feed_filter':
-        group_relational_operator = processed_feed.feed_group_relational_operator
-    elif filter_type == 'summary_filter':
-        group_relational_operator = processed_feed.summary_group_relational_operator
-
-    logger.debug(f'  Group results for {filter_type}: {group_results} for {entry.title}')
-    if group_relational_operator == 'all':
-        return all(group_results)
-    elif group_relational_operator == 'any':
-        return any(group_results)
-    elif group_relational_operator == 'none':
-        return not any(group_results)
-
-def match_content(entry, filter):
+
+def combine(operator, results):
+    'results 是惰性的可迭代对象，all/any 在结果确定时就停止求值'
+    if operator == 'all':
+        return all(results)
+    elif operator == 'any':
+        return any(results)
+    elif operator == 'none':
+        return not any(results)
+
+
+def filter_content(entry, field):
+    'entry 是 entry.Entry'
     content = ''
-    if filter.field in ['title', 'title_or_content']:
-        content += generate_untitled(entry) + ' '
-    if filter.field in ['content', 'title_or_content']:
-        try:
-            content += entry.content[0].value + ' '
-        except:
-            pass
-        try:
-            content += entry.description + ' '
-        except:
-            pass
-    elif filter.field == 'link':
+    if field in ['title', 'title_or_content']:
+        content += entry.title + ' '
+    if field in ['content', 'title_or_content']:
+        content += entry.text
+    elif field == 'link':
         content = entry.link
-    if not content.strip(): # Strip is necessary for removing leading and trailing spaces
+    return content
+
+
+LITERAL_MATCH_TYPES = ('contains', 'does_not_contain')
+REGEX_MATCH_TYPES = ('matches_regex', 'does_not_match_regex')
+BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+class CompiledFilter:
+    '''
+    预处理过的 Filter：正则预编译，长度比较的值预先转成整数。
+    hits 是 FieldMatcher 对这个字段算出的命中集合，字符串和正则类的 filter 直接查集合。
+    '''
+    __slots__ = ('field', 'match_type', 'value', 'pattern', 'length')
+
+    def __init__(self, filter):
+        self.field = filter.field
+        self.match_type = filter.match_type
+        self.value = filter.value
+        self.pattern = re.compile(filter.value) if filter.match_type in REGEX_MATCH_TYPES else None
+        self.length = int(filter.value) if filter.match_type in ['shorter_than', 'longer_than'] else None
+
+    def matches(self, content, hits=None):
+        if not content.strip(): # Strip is necessary for removing leading and trailing spaces
+            return False
+
+        if self.match_type == 'contains':
+            return self.value in hits if hits is not None else self.value in content
+        elif self.match_type == 'does_not_contain':
+            return self.value not in hits if hits is not None else self.value not in content
+        elif self.match_type == 'matches_regex':
+            return self.pattern in hits if hits is not None else self.pattern.search(content) is not None
+        elif self.match_type == 'does_not_match_regex':
+            return self.pattern not in hits if hits is not None else self.pattern.search(content) is None
+        elif self.match_type == 'shorter_than':
+            return len(content) < self.length
+        elif self.match_type == 'longer_than':
+            return len(content) > self.length
+
+
+def mergeable_regex(pattern):
+    '能否放进交替正则：带反向引用或全局内联 flag（如开头的 (?i)）的正则只能单独匹配'
+    if BACKREFERENCE_RE.search(pattern.pattern):
         return False
-
-    if filter.match_type == 'contains':
-        return filter.value in content
-    elif filter.match_type == 'does_not_contain':
-        return filter.value not in content
-    elif filter.match_type == 'matches_regex':
-        return re.search(filter.value, content) is not None
-    elif filter.match_type == 'does_not_match_regex':
-        return re.search(filter.value, content) is None
-    elif filter.match_type == 'shorter_than':
-        return len(content) < int(filter.value)
-    elif filter.match_type == 'longer_than':
-        return len(content) > int(filter.value)
+    try:
+        re.compile(f'(?:{pattern.pattern})|(?:)')
+    except re.error:
+        return False
+    return True
+
+
+class FieldMatcher:
+    '''
+    一个字段上所有字符串和正则类 filter 合并后的匹配器，每个 entry 的这个字段只整体扫描一遍。
+    字符串放进一个 Aho-Corasick 自动机（pyahocorasick），一次扫描得到全部命中；没有安装时用转义后的交替正则预筛。
+    能合并的正则放进一个交替正则预筛：大部分 entry 一个都不命中，一次扫描就能确定；
+    预筛命中时再逐个确认，因为交替正则在同一位置只报告第一个匹配的分支，不能直接当作完整的命中集合。
+    '''
+
+    def __init__(self, literals, patterns):
+        self.literals = [literal for literal in dict.fromkeys(literals) if literal]
+        self.empty_literal = '' in literals  # 空字符串总是命中
+        self.automaton = None
+        self.literal_prefilter = None
+        if ahocorasick and self.literals:
+            self.automaton = ahocorasick.Automaton()
+            for literal in self.literals:
+                self.automaton.add_word(literal, literal)
+            self.automaton.make_automaton()
+        elif len(self.literals) > 1:
+            self.literal_prefilter = re.compile('|'.join(re.escape(literal) for literal in self.literals))
+
+        patterns = list(dict.fromkeys(patterns))
+        self.patterns = [pattern for pattern in patterns if mergeable_regex(pattern)]
+        self.unmerged_patterns = [pattern for pattern in patterns if not mergeable_regex(pattern)]
+        self.regex_prefilter = None
+        if len(self.patterns) > 1:
+            try:
+                self.regex_prefilter = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern in self.patterns))
+            except re.error as e:
+                # 单独合法的正则合并后也可能不合法，比如两个 filter 用了同名的命名分组，这时逐个匹配
+                logger.debug(f'  Cannot merge {len(self.patterns)} regex filters, matching them one by one: {str(e)}')
+                self.unmerged_patterns += self.patterns
+                self.patterns = []
+
+    def hits(self, content):
+        'Returns: 命中的字符串（filter.value）和正则（编译后的 pattern）集合'
+        hits = {''} if self.empty_literal else set()
+        if self.automaton is not None:
+            hits.update(literal for _, literal in self.automaton.iter(content))
+        elif self.literal_prefilter is None or self.literal_prefilter.search(content):
+            hits.update(literal for literal in self.literals if literal in content)
+
+        if self.regex_prefilter is None or self.regex_prefilter.search(content):
+            hits.update(pattern for pattern in self.patterns if pattern.search(content))
+        hits.update(pattern for pattern in self.unmerged_patterns if pattern.search(content))
+        return hits
+
+
+class FilterPlan:
+    '''
+    一个 processed feed 某种用途（feed_filter / summary_filter）的全部 FilterGroup，编译一次后常驻内存。
+    同一字段上所有组的字符串和正则 filter 合并成一个 FieldMatcher，求值时每个 entry 的各字段内容只拼接、扫描一次，
+    all/any/none 再根据命中集合计算，组内和组间都短路求值。
+    '''
+
+    def __init__(self, groups, group_relational_operator):
+        self.groups = groups  # [(relational_operator, [CompiledFilter])]
+        self.group_relational_operator = group_relational_operator
+        literals, patterns = defaultdict(list), defaultdict(list)
+        for operator, filters in groups:
+            for filter in filters:
+                if filter.match_type in LITERAL_MATCH_TYPES:
+                    literals[filter.field].append(filter.value)
+                elif filter.match_type in REGEX_MATCH_TYPES:
+                    patterns[filter.field].append(filter.pattern)
+        self.matchers = {field: FieldMatcher(literals[field], patterns[field]) for field in literals.keys() | patterns.keys()}
+
+    @classmethod
+    def compile(cls, processed_feed, filter_type):
+        groups = [
+            (group.relational_operator, [CompiledFilter(filter) for filter in group.filters.all()])
+            for group in processed_feed.filter_groups.filter(usage=filter_type).prefetch_related('filters')
+        ]
+        if filter_type == 'feed_filter':
+            group_relational_operator = processed_feed.feed_group_relational_operator
+        elif filter_type == 'summary_filter':
+            group_relational_operator = processed_feed.summary_group_relational_operator
+        return cls(groups, group_relational_operator)
+
+    def passes(self, entry):
+        if not self.groups:
+            return True
+        contents = {}
+        hits = {}
+
+        def match(filter):
+            field = filter.field
+            if field not in contents:
+                contents[field] = filter_content(entry, field)
+            if field in self.matchers and field not in hits:
+                hits[field] = self.matchers[field].hits(contents[field])
+            return filter.matches(contents[field], hits.get(field))
+
+        result = combine(self.group_relational_operator, (
+            combine(operator, (match(filter) for filter in filters))
+            for operator, filters in self.groups
+        ))
+        logger.debug(f'  Filter result: {result} for {entry.title}')
+        return result
 
 
 def remove_think_part(response):
@@ -188,106 +286,14 @@ def remove_think_part(response):
 
 
 def generate_summary(article, model, output_mode='json', prompt=None, other_model=''):
-    if model == 'other':
-        model = other_model
-    if not model or not OPENAI_API_KEY:
-        logger.warning('  OpenAI API key or model not set, skipping summary generation')
-        return 
-    try:
-        client_params = {
-            "api_key": OPENAI_API_KEY,
-            "base_url": OPENAI_BASE_URL
-        }
-
-        completion_params = {
-            "model": model,
-        }
-
-        # start_time = time.time()
-
-        # # DeepSeek 的处理逻辑
-        # logger.debug(f"                    [-] 使用deepseek-r1模型生成摘要")
-        # client = OpenAI(**client_params)
-        # truncated_query = clean_txt_and_truncate(article.content, model, clean_bool=True)
-        # messages_tt=[{
-        #     "role":"user",
-        #     "content": prompt + '  原文内容是 : ' + truncated_query
-        #     }]
-        # logger.debug(f"                    [-] prompt is 【{prompt[:100] + '  原文内容是 : ' + truncated_query[:100]}】 \n.... \n")
-        # completion = client.chat.completions.create(
-        #     model="deepseek-ai/deepseek-r1",
-        #     messages=messages_tt,
-        #     temperature=0.6,
-        #     top_p=0.7,
-        #     max_tokens=4096,
-        #     stream=True
-        #     )
-
-        # for chunk in completion:
-        #     if chunk.choices[0].delta.content is not None:
-        #         print(chunk.choices[0].delta.content, end="")
-            
-        # end_time = time.time()
-        # elapsed_time = end_time - start_time
-        # logger.info(f"                    [-] Deepseek摘要生成耗时: {elapsed_time:.2f}秒")
-        # return remove_think_part(completion.choices[0].message.content)
-
-
-        # OPENAI的处理逻辑
-        if OPENAI_PROXY:
-            client_params["http_client"] = httpx.Client(proxy=OPENAI_PROXY)
-        client = OpenAI(**client_params)
-        # 自定义prompt 
-        #prompt = ''' '''
-        if output_mode == 'json':
-            truncated_query = clean_txt_and_truncate(article.content, model, clean_bool=True)
-            #additional_prompt = f"Please summarize this article, and output the result only in JSON format. First item of the json is a one-line summary in 15 words named as 'summary_one_line', second item is the 150-word summary named as 'summary_long'. Output result in {language} language."
-            messages = [
-                {
-                    "role": "system", 
-                    "content": '''
-                            你是一个用于总结文章的有用助手，输出采用JSON格式，一定要输出纯文本的json格式，使用{做开头，}做结尾，不要有任何其他的用于标注代码块的符号。 eg:
-                            {
-                            "summary_one_line": "新型多态攻击伪装密码管理器作案",
-                            "summary_long": "3月6日，攻击者采用新型多态攻击方式，使用Chrome扩展滥用chrome.management API，冒充合法密码管理器（如1Password），伪造登录页面诱骗用户输入敏感信息。完成钓鱼操作后，恶意扩展恢复原状，致使攻击难以被察觉。研究人员建议谷歌尽快加强防护措施，目前尚无有效对策。",
-                            "title": "恶意Chrome扩展伪装密码管理器实施多态攻击窃取敏感信息",
-                            "tag": "网络攻击"
-                            }
-                            '''
-                },
-                {"role": "user", "content": f"<prompt> {prompt}</prompt> \n  <article> {truncated_query}</article> "},
-                # {"role": "assistant", "content": f"<prompt> {prompt}</prompt>"},
-            ]
-            completion_params["response_format"] = { "type": "json_object" }
-            completion_params["messages"] = messages
-        elif output_mode == 'HTML':
-            truncated_query = clean_txt_and_truncate(article.content, model, clean_bool=False)
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant for summarizing article content, designed to output pure and clean json format, do not code block the output using triple backticks."},
-                {"role": "user", "content": f"<article> {truncated_query}</article> \n <prompt> {prompt}</prompt>"},
-                # {"role": "assistant", "content": f"<prompt> {prompt}</prompt>"},
-            ]
-            completion_params["messages"] = messages
-        elif output_mode == 'md':
-            # 自定义摘要生成过程
-            truncated_query = clean_txt_and_truncate(article.content, model, clean_bool=False)
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant for summarizing article content, designed to output pure and clean json format, do not code block the output using triple backticks."},
-                {"role": "user", "content": f"<article> {truncated_query}</article> \n <prompt> {prompt}</prompt>"},
-                # {"role": "assistant", "content": f"<prompt> {prompt}</prompt>"},
-            ]
-            completion_params["messages"] = messages
-
-        completion = client.chat.completions.create(**completion_params)
-        logger.debug(f"prompt is 【{prompt[:50]}】 \n.... \n")
-        logger.debug(f"content is 【{truncated_query}】 \n.... \n")
-        return completion.choices[0].message.content
-        # OPENAI的处理逻辑 end
-        
-
-    except Exception as e:
-        logger.error(f'Failed to generate summary for article {article.title}: {str(e)}')
-    
+    '''
+    同步生成 summary，请求经由进程内共享的 SummaryExecutor 发出；需要并行请求多篇文章时用 summarizer.executor.submit
+    Returns:
+        模型的输出，没有配置 API key 或模型、请求失败时为 None
+    '''
+    return summary_executor.submit(article, model, output_mode, prompt, other_model).result()
+
+
 def parse_cron(cron_string):
     parts = cron_string.split()
     if len(parts) != 5:
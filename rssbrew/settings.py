@@ -230,4 +230,24 @@ HUEY = RedisHuey(
     store_none=False,
 )
 
+# 生成 summary 的任务单独一个队列，由 run_summary_huey 启动的 consumer 处理，慢的 LLM 请求不占用更新 feed 的 worker
+SUMMARY_HUEY = RedisHuey(
+    'rssbrew-summary',
+    host=os.environ.get('REDIS_HOST', 'redis'),
+    port=int(os.environ.get('REDIS_PORT', 6379)),
+    db=int(os.environ.get('REDIS_DB', 0)),
+    result_store=False,
+)
+SUMMARY_WORKERS = int(os.environ.get('SUMMARY_WORKERS', 4))  # summary 队列的 worker 线程数
+
+# 已知 entry 索引（FeedManager/entry_index.py）等缓存放在 Redis 中：web 进程里修改 filter 后清除的缓存，
+# 要对 huey worker 中运行的 update_feeds 可见，进程内存缓存做不到
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'redis')}:{os.environ.get('REDIS_PORT', 6379)}/{os.environ.get('REDIS_DB', 0)}",
+        'KEY_PREFIX': 'rssbrew',
+    }
+}
+
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10240
\ No newline at end of file
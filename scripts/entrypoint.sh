@@ -19,5 +19,6 @@ python3 /app/manage.py init_server
 
 mkdir -p /app/logs
 python3 /app/manage.py run_huey >> /app/logs/huey.log 2>&1 &
+python3 /app/manage.py run_summary_huey >> /app/logs/huey_summary.log 2>&1 &
 
 exec gunicorn rssbrew.wsgi:application --bind 0.0.0.0:8000